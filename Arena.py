@@ -1,16 +1,77 @@
 import logging
+import math
+from concurrent.futures import as_completed
 
+import numpy as np
 from tqdm import tqdm
 
+from MCTS import MCTS, aggregateStats
+from utils import workerPool
+
+EPS = 1e-8
+
 log = logging.getLogger(__name__)
 
 
+class MCTSPlayerFactory():
+    """
+    Picklable recipe for a player that plays the most visited action of an
+    MCTS search with the network saved in folder/filename, for the worker
+    processes of Arena.playGames. Calling it loads the network and returns
+    the player and its MCTS.
+    """
+
+    def __init__(self, game, nnetClass, folder, filename, args):
+        self.game = game
+        self.nnetClass = nnetClass
+        self.folder = folder
+        self.filename = filename
+        self.args = args
+
+    def __call__(self):
+        nnet = self.nnetClass(self.game)
+        nnet.load_checkpoint(folder=self.folder, filename=self.filename)
+        mcts = MCTS(self.game, nnet, self.args)
+        return lambda x: np.argmax(mcts.getActionProb(x, temp=0)), mcts
+
+
+_arena = None  # Arena of a worker process of Arena.playGames, with the players built by the factories
+
+
+def initArenaWorker(game, factories):
+    """
+    Initializes a worker process of Arena.playGames, building its players
+    once for all the games it plays.
+    """
+    global _arena
+    (player1, search1), (player2, search2) = [factory() for factory in factories]
+    _arena = Arena(player1, player2, game, searches=(search1, search2))
+
+
+def playArenaGame(swapped):
+    """
+    Plays one game in a worker process of Arena.playGames, started by player2
+    if swapped, else by player1.
+
+    Returns:
+        gameResult: as returned by Arena.playGame, from the point of view of
+                    player1 even if swapped
+        stats: the searchStats of the searches of player1 and player2 in the
+               game, see MCTS.popStats
+    """
+    arena = Arena(_arena.player2, _arena.player1, _arena.game) if swapped else _arena
+    gameResult = arena.playGame()
+    if swapped:
+        gameResult = -gameResult
+    return gameResult, [mcts.popStats() if mcts is not None else [] for mcts in _arena.searches]
+
+
 class Arena():
     """
     An Arena class where any 2 agents can be pit against each other.
     """
 
-    def __init__(self, player1, player2, game, display=None):
+    def __init__(self, player1, player2, game, display=None, searches=None, factories=None):
         """
         Input:
             player 1,2: two functions that takes board as input, return action
@@ -18,6 +79,13 @@ class Arena():
             display: a function that takes board as input and prints it (e.g.
                      display in othello/OthelloGame). Is necessary for verbose
                      mode.
+            searches: optionally the MCTS objects used by player1 and player2.
+                      With args.collectStats, playGames then aggregates their
+                      search statistics into self.searchStats.
+            factories: optionally picklable callables that build player1 and
+                       player2 (with their MCTS or None) in another process,
+                       such as MCTSPlayerFactory. They let playGames play the
+                       games in several worker processes.
 
         see othello/OthelloPlayers.py for an example. See pit.py for pitting
         human players/other baselines with each other.
@@ -26,6 +94,10 @@ class Arena():
         self.player2 = player2
         self.game = game
         self.display = display
+        self.searches = searches
+        self.factories = factories
+        self.searchStats = None  # aggregated search statistics of player1 and player2 in the last playGames
+        self.sprt = None  # outcome of the test of the last playGamesSPRT
 
     def playGame(self, verbose=False):
         """
@@ -62,17 +134,29 @@ class Arena():
             self.display(board)
         return curPlayer * self.game.getGameEnded(board, curPlayer)
 
-    def playGames(self, num, verbose=False):
+    def playGames(self, num, verbose=False, workers=1):
         """
         Plays num games in which player1 starts num/2 games and player2 starts
         num/2 games.
 
+        With workers > 1 and factories, the games are played in that many
+        worker processes, which build their own players with the factories
+        (verbose is then ignored).
+
         Returns:
             oneWon: games won by player1
             twoWon: games won by player2
             draws:  games won by nobody
         """
 
+        if workers > 1 and self.factories is not None:
+            return self.playGamesParallel(num, workers)
+
+        if self.searches is not None:
+            for mcts in self.searches:
+                if mcts is not None:
+                    mcts.popStats()
+
         num = int(num / 2)
         oneWon = 0
         twoWon = 0
@@ -97,4 +181,131 @@ class Arena():
             else:
                 draws += 1
 
+        if self.searches is not None:
+            self.searchStats = [aggregateStats(mcts.popStats() if mcts is not None else []) for mcts in self.searches]
         return oneWon, twoWon, draws
+
+    def playGamesParallel(self, num, workers):
+        """
+        Version of playGames playing the games in worker processes, see
+        playGames.
+        """
+        num = int(num / 2)
+        oneWon = 0
+        twoWon = 0
+        draws = 0
+        results = self.gameResults([False] * num + [True] * num, workers)
+        for gameResult in tqdm(results, total=2 * num, desc="Arena.playGames"):
+            if gameResult == 1:
+                oneWon += 1
+            elif gameResult == -1:
+                twoWon += 1
+            else:
+                draws += 1
+        return oneWon, twoWon, draws
+
+    def playGamesSPRT(self, num, threshold, alpha=0.05, beta=0.05, margin=0.1, verbose=False, workers=1):
+        """
+        Plays at most num games like playGames, but stops as soon as a
+        sequential probability ratio test decides whether player2 wins at
+        least a fraction threshold of the games that are not drawn. The test
+        weighs p0 = threshold - margin against p1 = threshold + margin, and
+        wrongly accepts a player2 winning p0 of the games with probability at
+        most alpha, and wrongly rejects one winning p1 with probability at most
+        beta. The players take turns to start.
+
+        With workers > 1 and factories, the games are played in that many
+        worker processes (see playGames). The results are then taken in the
+        order the games end, and the games still running when the test ends
+        are dropped.
+
+        The outcome of the test is left in self.sprt: the decision ('accept',
+        'reject', or None if num games did not settle it), the number of games
+        played, the log likelihood ratio of p1 against p0, and the confidence
+        in the decision, which is the probability of its hypothesis given the
+        games if both were as likely beforehand.
+
+        Returns:
+            oneWon: games won by player1
+            twoWon: games won by player2
+            draws:  games won by nobody
+        """
+        p0 = min(max(threshold - margin, EPS), 1 - EPS)
+        p1 = min(max(threshold + margin, EPS), 1 - EPS)
+        winWeight = math.log(p1 / p0)
+        lossWeight = math.log((1 - p1) / (1 - p0))
+        lower = math.log(beta / (1 - alpha))
+        upper = math.log((1 - beta) / alpha)
+
+        oneWon = 0
+        twoWon = 0
+        draws = 0
+        llr = 0.
+        decision = None
+        results = self.gameResults([k % 2 == 1 for k in range(num)], workers, verbose)
+        for gameResult in tqdm(results, total=num, desc="Arena.playGamesSPRT"):
+            if gameResult == 1:
+                oneWon += 1
+                llr += lossWeight
+            elif gameResult == -1:
+                twoWon += 1
+                llr += winWeight
+            else:
+                draws += 1
+            if llr >= upper:
+                decision = 'accept'
+            elif llr <= lower:
+                decision = 'reject'
+            if decision is not None:
+                results.close()
+                break
+
+        confidence = 1 / (1 + math.exp(-llr if decision == 'accept' else llr)) if decision else None
+        self.sprt = {'decision': decision, 'games': oneWon + twoWon + draws, 'llr': llr, 'confidence': confidence}
+        return oneWon, twoWon, draws
+
+    def gameResults(self, starts, workers=1, verbose=False):
+        """
+        Plays one game for every entry of starts, started by player2 if it is
+        True, else by player1. With workers > 1 and factories, the games are
+        played in that many worker processes, which build their own players
+        with the factories (verbose is then ignored).
+
+        The search statistics of the games played are aggregated into
+        self.searchStats once the generator is exhausted or closed.
+
+        Yields:
+            gameResult: the result of each game as returned by playGame, from
+                        the point of view of player1, as the games end
+        """
+        if self.searches is not None:
+            for mcts in self.searches:
+                if mcts is not None:
+                    mcts.popStats()
+        stats = ([], [])
+        pool = None
+        try:
+            if workers > 1 and self.factories is not None:
+                pool = workerPool(workers, initArenaWorker, (self.game, self.factories))
+                futures = [pool.submit(playArenaGame, swapped) for swapped in starts]
+                for future in as_completed(futures):
+                    gameResult, gameStats = future.result()
+                    for searchStats, playerStats in zip(stats, gameStats):
+                        searchStats += playerStats
+                    yield gameResult
+            else:
+                swappedArena = Arena(self.player2, self.player1, self.game, self.display)
+                for swapped in starts:
+                    if swapped:
+                        yield -swappedArena.playGame(verbose=verbose)
+                    else:
+                        yield self.playGame(verbose=verbose)
+        finally:
+            if pool is not None:
+                # games still running are abandoned
+                pool.shutdown(wait=False, cancel_futures=True)
+            if self.searches is not None:
+                for searchStats, mcts in zip(stats, self.searches):
+                    if mcts is not None:
+                        searchStats += mcts.popStats()
+                self.searchStats = [aggregateStats(searchStats) for searchStats in stats]
@@ -2,14 +2,19 @@ import logging
 import os
 import sys
 from collections import deque
+from concurrent.futures import FIRST_COMPLETED, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
 from pickle import Pickler, Unpickler
 from random import shuffle
 
 import numpy as np
 from tqdm import tqdm
 
-from Arena import Arena
-from MCTS import MCTS
+from Arena import Arena, MCTSPlayerFactory
+from InferenceServer import InferenceServer
+from MCTS import MCTS, aggregateStats, runSteps
+from ReplayBuffer import ReplayBuffer
+from utils import workerPool
 
 from animalshogi.AnimalShogiPlayers import RandomPlayer, GreedyAnimalShogiPlayer
 from animalshogi.AnimalShogiGame import AnimalShogiGame as Game
@@ -17,6 +22,111 @@ from animalshogi.AnimalShogiGame import AnimalShogiGame as Game
 log = logging.getLogger(__name__)
 
 
+def resignValue(values, resignMoves):
+    """
+    Returns:
+        threshold: the lowest resign threshold that resignMoves consecutive
+                   root values of a player would have all stayed below at some
+                   point of the game, inf if there are fewer values than that
+    """
+    return min((max(values[i:i + resignMoves]) for i in range(len(values) - resignMoves + 1)), default=np.inf)
+
+
+def pitNetworks(arena, args):
+    """
+    Plays the arena games that decide whether the new network (player2 of
+    arena) replaces the previous one (player1): args.arenaCompare games, and
+    it is accepted if it wins at least updateThreshold of the games not drawn.
+    With args.arenaSprt the games stop as soon as a sequential probability
+    ratio test settles the decision, see Arena.playGamesSPRT, with error
+    rates args.sprtAlpha and args.sprtBeta (default 0.05) and
+    args.sprtMargin (default 0.1) around updateThreshold.
+
+    Returns:
+        pwins, nwins, draws: the wins of the previous and of the new network,
+                             and the draws
+        accepted: whether the new network is accepted
+    """
+    workers = getattr(args, 'arenaWorkers', 1)
+    if getattr(args, 'arenaSprt', False):
+        pwins, nwins, draws = arena.playGamesSPRT(args.arenaCompare, args.updateThreshold,
+                                                  alpha=getattr(args, 'sprtAlpha', 0.05),
+                                                  beta=getattr(args, 'sprtBeta', 0.05),
+                                                  margin=getattr(args, 'sprtMargin', 0.1), workers=workers)
+        sprt = arena.sprt
+        if sprt['decision'] is not None:
+            log.info(f"SPRT: {sprt['decision']} after {sprt['games']} of {args.arenaCompare} games "
+                     f"(confidence {sprt['confidence']:.1%})")
+            return pwins, nwins, draws, sprt['decision'] == 'accept'
+        log.info(f"SPRT: undecided after {sprt['games']} games")
+    else:
+        pwins, nwins, draws = arena.playGames(args.arenaCompare, workers=workers)
+    accepted = pwins + nwins > 0 and float(nwins) / (pwins + nwins) >= args.updateThreshold
+    return pwins, nwins, draws, accepted
+
+
+def evaluateCheckpoint(game, nnetClass, args, folder, candidate, best):
+    """
+    Pits the network saved in folder/candidate against the one saved in
+    folder/best (see pitNetworks), in the evaluator process of
+    Coach.learnAsync.
+
+    Returns:
+        pwins, nwins, draws, accepted: as returned by pitNetworks
+    """
+    factories = (MCTSPlayerFactory(game, nnetClass, folder, best, args),
+                 MCTSPlayerFactory(game, nnetClass, folder, candidate, args))
+    (pplayer, pmcts), (nplayer, nmcts) = [factory() for factory in factories]
+    arena = Arena(pplayer, nplayer, game, searches=(pmcts, nmcts), factories=factories)
+    try:
+        return pitNetworks(arena, args)
+    finally:
+        pmcts.closeRootWorkers()
+        nmcts.closeRootWorkers()
+
+
+_selfPlayCoach = None  # Coach of a self-play worker process
+_selfPlayCheckpoint = None  # (folder, filename, model version) of the weights it has loaded
+
+
+def initSelfPlayWorker(game, nnetClass, args, client=None):
+    """
+    Initializes a worker process of Coach.executeEpisodesParallel. It plays
+    with the InferenceClient client if it is given, else with a network of
+    its own.
+    """
+    global _selfPlayCoach
+    _selfPlayCoach = Coach(game, client if client is not None else nnetClass(game), args)
+
+
+def selfPlayEpisode(checkpoint, resignThreshold, seed):
+    """
+    Plays one episode of self-play in a worker process with the weights of
+    checkpoint, which are only loaded if they differ from those of the
+    previous episode (None with an inference server), and the resign
+    threshold of the parent Coach.
+
+    Returns:
+        trainExamples: as returned by Coach.executeEpisode
+        stats: the searchStats of its searches, with args.collectStats
+        resigned: 1 if the episode was ended by resignation, else 0
+        resignChecks: the entry it adds to Coach.resignChecks, if it was
+                      played to the end to check the resignations
+    """
+    global _selfPlayCheckpoint
+    coach = _selfPlayCoach
+    if checkpoint is not None and _selfPlayCheckpoint != checkpoint:
+        coach.nnet.load_checkpoint(folder=checkpoint[0], filename=checkpoint[1])
+        _selfPlayCheckpoint = checkpoint
+    np.random.seed(seed)
+    coach.resignThreshold = resignThreshold
+    coach.resignedGames = 0
+    coach.resignChecks.clear()
+    coach.mcts = MCTS(coach.game, coach.nnet, coach.args)
+    trainExamples = coach.executeEpisode()
+    return trainExamples, coach.mcts.popStats(), coach.resignedGames, list(coach.resignChecks)
+
+
 class Coach():
     """
     This class executes the self-play + learning. It uses the functions defined
@@ -26,11 +136,22 @@ class Coach():
     def __init__(self, game, nnet, args):
         self.game = game
         self.nnet = nnet
-        self.pnet = self.nnet.__class__(self.game)  # the competitor network
+        self.pnet = None  # the competitor network, created in learn (self-play workers do not need one)
         self.args = args
         self.mcts = MCTS(self.game, self.nnet, self.args)
         self.trainExamplesHistory = []  # history of examples from args.numItersForTrainExamplesHistory latest iterations
         self.skipFirstSelfPlay = False  # can be overriden in loadTrainExamples()
+        self.replayBuffer = None  # ReplayBuffer replacing trainExamplesHistory with args.replayBuffer, see openReplayBuffer
+        self.selfPlayStats = []  # searchStats of the self-play searches of the iteration, with args.collectStats
+        self.resignThreshold = getattr(args, 'resignThreshold', None)  # None never resigns
+        # for the recent games played to the end despite resignation: the lowest
+        # threshold above which a player that did not lose would have resigned
+        self.resignChecks = deque([], maxlen=getattr(args, 'resignCheckGames', 200))
+        self.resignedGames = 0  # self-play games of the iteration ended by resignation
+        self.selfPlayPool = None  # worker processes of executeEpisodesParallel, started on first use
+        self.inferenceServer = None  # InferenceServer of the workers, with args.inferenceServer
+        self.selfPlayGeneration = 0  # number of weights handed to the workers, see selfPlayWeights
+        self.selfPlayFailures = 0  # self-play episodes that failed, see selfPlayFailed
 
     def executeEpisode(self):
         """
@@ -43,33 +164,247 @@ class Coach():
         It uses a temp=1 if episodeStep < tempThreshold, and thereafter
         uses temp=0.
 
+        With playout cap randomization (args.fullSearchProb < 1), only a
+        random args.fullSearchProb fraction of the moves are searched with
+        the full numMCTSSims simulations and added to trainExamples. The
+        other moves are played after a fast search of args.fastMCTSSims
+        simulations and give no policy target, so more games are played for
+        the same number of simulations.
+
+        With args.resignThreshold set, the player to move resigns once the
+        root value of its last args.resignMoves (default 1) searches has
+        stayed below self.resignThreshold. A random args.resignCheckFraction
+        (default 0.1) of the games are played to the end regardless, to
+        measure how often resigning would have been a mistake, see
+        calibrateResignation.
+
         Returns:
             trainExamples: a list of examples of the form (canonicalBoard, currPlayer, pi,v)
                            pi is the MCTS informed policy vector, v is +1 if
                            the player eventually won the game, else -1.
         """
+        return runSteps(self.episodeSteps(self.mcts), self.nnet)
+
+    def episodeSteps(self, mcts):
+        """
+        Generator version of executeEpisode playing with the search tree mcts.
+        It yields the leaf boards its searches need evaluated and expects their
+        (pis, vs) to be sent back, see MCTS.getActionProbSteps.
+
+        Returns:
+            trainExamples: as returned by executeEpisode
+        """
         trainExamples = []
         board = self.game.getInitBoard()
-        self.curPlayer = 1
+        curPlayer = 1
         episodeStep = 0
+        fullSearchProb = getattr(self.args, 'fullSearchProb', 1.)
+        resignMoves = getattr(self.args, 'resignMoves', 1)
+        resignCheck = False
+        if self.resignThreshold is not None:
+            resignCheck = np.random.random() < getattr(self.args, 'resignCheckFraction', 0.1)
+        values = {1: [], -1: []}  # root values seen by each player
 
         while True:
             episodeStep += 1
-            canonicalBoard = self.game.getCanonicalForm(board, self.curPlayer)
+            canonicalBoard = self.game.getCanonicalForm(board, curPlayer)
             temp = int(episodeStep < self.args.tempThreshold)
 
-            pi = self.mcts.getActionProb(canonicalBoard, temp=temp)
-            sym = self.game.getSymmetries(canonicalBoard, pi)
-            for b, p in sym:
-                trainExamples.append([b, self.curPlayer, p, None])
+            fullSearch = fullSearchProb >= 1 or np.random.random() < fullSearchProb
+            numSims = None if fullSearch else self.args.fastMCTSSims
+            pi = yield from mcts.getActionProbSteps(canonicalBoard, temp=temp, numSims=numSims)
+            if fullSearch:
+                sym = self.game.getSymmetries(canonicalBoard, pi)
+                for b, p in sym:
+                    trainExamples.append([b, curPlayer, p, None])
+
+            if self.resignThreshold is not None:
+                values[curPlayer].append(mcts.rootValue(canonicalBoard))
+                recent = values[curPlayer][-resignMoves:]
+                if not resignCheck and len(recent) == resignMoves and max(recent) < self.resignThreshold:
+                    self.resignedGames += 1
+                    return [(x[0], x[2], -((-1) ** (x[1] != curPlayer))) for x in trainExamples]
 
             action = np.random.choice(len(pi), p=pi)
-            board, self.curPlayer = self.game.getNextState(board, self.curPlayer, action)
+            board, curPlayer = self.game.getNextState(board, curPlayer, action)
 
-            r = self.game.getGameEnded(board, self.curPlayer)
+            r = self.game.getGameEnded(board, curPlayer)
 
             if r != 0:
-                return [(x[0], x[2], r * ((-1) ** (x[1] != self.curPlayer))) for x in trainExamples]
+                if resignCheck:
+                    # only a player that did not lose would have been wrong to resign
+                    self.resignChecks.append(min([resignValue(values[player], resignMoves)
+                                                  for player in [1, -1] if r * player * curPlayer > -1],
+                                                 default=np.inf))
+                return [(x[0], x[2], r * ((-1) ** (x[1] != curPlayer))) for x in trainExamples]
+
+    def executeEpisodesLockstep(self, numEps):
+        """
+        Plays numEps episodes of self-play, keeping args.lockstepGames of them
+        in progress at once, each with its own search tree. At every step the
+        leaves that all the games in progress need evaluated are gathered and
+        evaluated with a single nnet.predictBatch call. A finished game is
+        replaced by a new one until numEps games have been started.
+
+        Returns:
+            trainExamples: the examples of all episodes, as returned by
+                           executeEpisode
+        """
+        trainExamples = []
+        games = []  # (episode generator, its search tree, leaf boards it waits for)
+        started = 0
+        with tqdm(total=numEps, desc="Self Play") as progress:
+            while games or started < numEps:
+                while len(games) < self.args.lockstepGames and started < numEps:
+                    started += 1
+                    mcts = MCTS(self.game, self.nnet, self.args)
+                    steps = self.episodeSteps(mcts)
+                    try:
+                        games.append((steps, mcts, next(steps)))
+                    except StopIteration as stop:
+                        trainExamples += stop.value
+                        self.selfPlayStats += mcts.popStats()
+                        progress.update()
+
+                if not games:
+                    continue
+                pis, vs = self.nnet.predictBatch([board for _, _, boards in games for board in boards])
+                waiting = []
+                start = 0
+                for steps, mcts, boards in games:
+                    end = start + len(boards)
+                    try:
+                        waiting.append((steps, mcts, steps.send((pis[start:end], vs[start:end]))))
+                    except StopIteration as stop:
+                        trainExamples += stop.value
+                        self.selfPlayStats += mcts.popStats()
+                        progress.update()
+                    start = end
+                games = waiting
+
+        return trainExamples
+
+    def executeEpisodesParallel(self, numEps):
+        """
+        Plays numEps episodes of self-play with executeEpisode in
+        args.selfPlayWorkers worker processes. The current weights of nnet are
+        saved to args.checkpoint, and every worker loads them before its first
+        episode with these weights. The workers stay alive between
+        iterations, so they are only started once. Each episode is seeded on
+        its own, so the workers do not play the same games, and its examples
+        are sent back as soon as it ends.
+
+        An episode whose worker raised an exception or died is played again,
+        by new workers if the pool broke, until more than
+        args.selfPlayMaxFailures (default 10) episodes have failed.
+
+        With args.inferenceServer the workers hold no network: they send
+        their boards to an InferenceServer, which evaluates those of all the
+        workers together with the current weights of nnet.
+
+        Returns:
+            trainExamples: the examples of all episodes, as returned by
+                           executeEpisode
+        """
+        filename = 'selfplay.pth.tar'
+        self.nnet.save_checkpoint(folder=self.args.checkpoint, filename=filename)
+        checkpoint = self.selfPlayWeights(self.args.checkpoint, filename)
+        self.selfPlayFailures = 0
+        trainExamples = []
+        remaining = numEps
+        with tqdm(total=numEps, desc="Self Play") as progress:
+            while remaining > 0:
+                futures = [self.submitEpisode(checkpoint) for _ in range(remaining)]
+                try:
+                    for future in as_completed(futures):
+                        examples = self.episodeResult(future)
+                        if examples is not None:
+                            trainExamples += examples
+                            remaining -= 1
+                            progress.update()
+                except BrokenProcessPool:
+                    # a worker died: the episodes still queued are failed too
+                    self.restartSelfPlayWorkers()
+
+        return trainExamples
+
+    def selfPlayWeights(self, folder, filename):
+        """
+        Makes the self-play workers play the episodes submitted from now on
+        with the weights saved in folder/filename. With args.inferenceServer
+        the server loads them at once (and is started if needed), otherwise
+        every worker loads them before its first such episode.
+
+        Returns:
+            checkpoint: the checkpoint to give to selfPlayEpisode
+        """
+        if getattr(self.args, 'inferenceServer', False):
+            if self.inferenceServer is None:
+                self.inferenceServer = InferenceServer(self.game, self.nnet, self.args)
+            self.inferenceServer.loadCheckpoint(folder, filename)
+            return None
+        self.selfPlayGeneration += 1
+        return folder, filename, self.selfPlayGeneration
+
+    def submitEpisode(self, checkpoint):
+        """
+        Queues an episode of self-play with the weights of checkpoint (see
+        selfPlayWeights) on the self-play workers, starting them if needed.
+
+        Returns:
+            future: the concurrent.futures.Future of the selfPlayEpisode call
+        """
+        if self.selfPlayPool is None:
+            client = self.inferenceServer.client() if self.inferenceServer is not None else None
+            self.selfPlayPool = workerPool(self.args.selfPlayWorkers, initSelfPlayWorker,
+                                           (self.game, self.nnet.__class__, self.args, client))
+        return self.selfPlayPool.submit(selfPlayEpisode, checkpoint, self.resignThreshold,
+                                        np.random.randint(2 ** 31 - 1))
+
+    def episodeResult(self, future):
+        """
+        Adds the statistics and the resignation data of the finished episode
+        of future to those of the Coach. An exception raised by the episode is
+        logged and counted, see selfPlayFailed; BrokenProcessPool is raised
+        again if its worker died.
+
+        Returns:
+            trainExamples: the examples of the episode, None if it failed
+        """
+        try:
+            trainExamples, stats, resigned, resignChecks = future.result()
+        except BrokenProcessPool:
+            raise
+        except Exception:
+            log.exception('A self-play episode failed')
+            self.selfPlayFailed()
+            return None
+        self.selfPlayStats += stats
+        self.resignedGames += resigned
+        self.resignChecks.extend(resignChecks)
+        return trainExamples
+
+    def restartSelfPlayWorkers(self):
+        """
+        Shuts down the self-play workers once one of them died, so that new
+        ones are started by the next submitEpisode.
+        """
+        log.error('A self-play worker died, restarting the workers')
+        self.selfPlayFailed()
+        self.closeSelfPlayWorkers()
+        if self.inferenceServer is not None:
+            self.inferenceServer.resetSlots()
+
+    def selfPlayFailed(self):
+        self.selfPlayFailures += 1
+        if self.selfPlayFailures > getattr(self.args, 'selfPlayMaxFailures', 10):
+            self.closeSelfPlayWorkers()
+            raise RuntimeError(f'{self.selfPlayFailures} self-play episodes failed')
+
+    def closeSelfPlayWorkers(self):
+        if self.selfPlayPool is not None:
+            self.selfPlayPool.shutdown(cancel_futures=True)
+            self.selfPlayPool = None
 
     def learn(self):
         """
@@ -78,12 +413,18 @@ class Coach():
         examples in trainExamples (which has a maximum length of maxlenofQueue).
         It then pits the new neural network against the old one and accepts it
         only if it wins >= updateThreshold fraction of games.
+
+        With args.asyncPipeline the three steps overlap instead, see
+        learnAsync.
         """
+        if getattr(self.args, 'asyncPipeline', False):
+            return self.learnAsync()
 
         next_i = 1
         while os.path.exists(self.nnet.get_filepath(self.args.checkpoint, self.getCheckpointFile(next_i))):
             next_i += 1
 
+        self.openReplayBuffer()
         for i in range(next_i, self.args.numIters + 1):
             # bookkeeping
             log.info(f'Starting Iter #{i} ...')
@@ -91,29 +432,53 @@ class Coach():
             if not self.skipFirstSelfPlay or i > 1:
                 iterationTrainExamples = deque([], maxlen=self.args.maxlenOfQueue)
 
-                for _ in tqdm(range(self.args.numEps), desc="Self Play"):
-                    self.mcts = MCTS(self.game, self.nnet, self.args)  # reset search tree
-                    iterationTrainExamples += self.executeEpisode()
+                if getattr(self.args, 'selfPlayWorkers', 1) > 1:
+                    iterationTrainExamples += self.executeEpisodesParallel(self.args.numEps)
+                elif getattr(self.args, 'lockstepGames', 1) > 1:
+                    iterationTrainExamples += self.executeEpisodesLockstep(self.args.numEps)
+                else:
+                    for _ in tqdm(range(self.args.numEps), desc="Self Play"):
+                        self.mcts = MCTS(self.game, self.nnet, self.args)  # reset search tree
+                        iterationTrainExamples += self.executeEpisode()
+                        self.selfPlayStats += self.mcts.popStats()
+
+                if self.resignThreshold is not None:
+                    resigned, self.resignedGames = self.resignedGames, 0
+                    threshold = self.resignThreshold
+                    falsePositives = self.calibrateResignation()
+                    log.info(f'Resigned {resigned} of {self.args.numEps} self-play games at {threshold:.3f}'
+                             + ('' if falsePositives is None else
+                                f', {falsePositives:.1%} of {len(self.resignChecks)} games played to the end '
+                                f'would have been resigned wrongly') + f'; resign threshold now {self.resignThreshold:.3f}')
 
                 # save the iteration examples to the history 
-                self.trainExamplesHistory.append(iterationTrainExamples)
-
-            if len(self.trainExamplesHistory) > self.args.numItersForTrainExamplesHistory:
-                log.warning(
-                    f"Removing the oldest entry in trainExamples. len(trainExamplesHistory) = {len(self.trainExamplesHistory)}")
-                self.trainExamplesHistory.pop(0)
-            # backup history to a file
-            # NB! the examples were collected using the model from the previous iteration, so (i-1)  
-            self.saveTrainExamples(i - 1)
-
-            # shuffle examples before training
-            trainExamples = []
-            for e in self.trainExamplesHistory:
-                trainExamples.extend(e)
-            shuffle(trainExamples)
+                if self.replayBuffer is not None:
+                    self.replayBuffer.extend(list(iterationTrainExamples))
+                else:
+                    self.trainExamplesHistory.append(iterationTrainExamples)
+
+            if self.replayBuffer is not None:
+                # the replay buffer is already on disk, and train samples its batches at random
+                trainExamples = self.replayBuffer
+            else:
+                if len(self.trainExamplesHistory) > self.args.numItersForTrainExamplesHistory:
+                    log.warning(
+                        f"Removing the oldest entry in trainExamples. len(trainExamplesHistory) = {len(self.trainExamplesHistory)}")
+                    self.trainExamplesHistory.pop(0)
+                # backup history to a file
+                # NB! the examples were collected using the model from the previous iteration, so (i-1)  
+                self.saveTrainExamples(i - 1)
+
+                # shuffle examples before training
+                trainExamples = []
+                for e in self.trainExamplesHistory:
+                    trainExamples.extend(e)
+                shuffle(trainExamples)
 
             # training new network, keeping a copy of the old one
             self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='temp.pth.tar')
+            if self.pnet is None:
+                self.pnet = self.nnet.__class__(self.game)
             self.pnet.load_checkpoint(folder=self.args.checkpoint, filename='temp.pth.tar')
             pmcts = MCTS(self.game, self.pnet, self.args)
 
@@ -123,18 +488,231 @@ class Coach():
             self.nnet.save_checkpoint(folder=self.args.checkpoint, filename=self.getCheckpointFile(i))
 
             log.info('PITTING AGAINST PREVIOUS VERSION')
+            factories = (MCTSPlayerFactory(self.game, self.nnet.__class__, self.args.checkpoint, 'temp.pth.tar', self.args),
+                         MCTSPlayerFactory(self.game, self.nnet.__class__, self.args.checkpoint,
+                                           self.getCheckpointFile(i), self.args))
             arena = Arena(lambda x: np.argmax(pmcts.getActionProb(x, temp=0)),
-                          lambda x: np.argmax(nmcts.getActionProb(x, temp=0)), self.game)
-            pwins, nwins, draws = arena.playGames(self.args.arenaCompare)
+                          lambda x: np.argmax(nmcts.getActionProb(x, temp=0)), self.game,
+                          searches=(pmcts, nmcts), factories=factories)
+            pwins, nwins, draws, accepted = pitNetworks(arena, self.args)
+            pmcts.closeRootWorkers()
+            nmcts.closeRootWorkers()
 
             log.info('NEW/PREV WINS : %d / %d ; DRAWS : %d' % (nwins, pwins, draws))
-            if pwins + nwins == 0 or float(nwins) / (pwins + nwins) < self.args.updateThreshold:
+            if not accepted:
                 log.info('REJECTING NEW MODEL')
                 self.nnet.load_checkpoint(folder=self.args.checkpoint, filename='temp.pth.tar')
             else:
                 log.info('ACCEPTING NEW MODEL')
                 self.nnet.save_checkpoint(folder=self.args.checkpoint, filename=self.getCheckpointFile(i))
-                self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='best.pth.tar')
+                self.saveBest(self.nnet)
+
+            if getattr(self.args, 'collectStats', False):
+                self.logStats('Self-play', aggregateStats(self.selfPlayStats))
+                self.logStats('Arena (previous)', arena.searchStats[0])
+                self.logStats('Arena (new)', arena.searchStats[1])
+                self.selfPlayStats = []
+
+            if self.inferenceServer is not None:
+                self.logInferenceStats(self.inferenceServer.stats())
+
+            if self.mcts.evalCache is not None:
+                stats = self.mcts.evalCache.stats()
+                log.info(f"Evaluation cache: {stats['hits']} hits / {stats['hits'] + stats['misses']} lookups "
+                         f"({stats['hitRate']:.1%}), {stats['entries']} entries")
+                self.mcts.evalCache.resetStats()
+
+        self.closeSelfPlayWorkers()
+        if self.inferenceServer is not None:
+            self.inferenceServer.close()
+            self.inferenceServer = None
+
+    def learnAsync(self):
+        """
+        Asynchronous version of learn, in which self-play, training and
+        evaluation run at the same time:
+        - the actors, args.selfPlayWorkers processes (see
+          executeEpisodesParallel), keep numEps episodes queued, played with
+          the weights of the last accepted network;
+        - the learner, this process, trains nnet with nnet.train on the
+          examples of trainExamplesHistory and of the games finished since
+          the last checkpoint, from the moment the first numEps games are in,
+          and then again every args.gamesPerTrainRound (default numEps) new
+          games, so that it never trains twice on the same data;
+        - the evaluator, another process, pits a checkpoint of nnet against
+          the last accepted network in an Arena while the learner goes on
+          training. A checkpoint that wins updateThreshold of the games
+          becomes the network of the actors, and is copied to best.pth.tar.
+
+        A checkpoint is saved once args.trainRoundsPerCheckpoint (default 1)
+        calls of nnet.train have been made since the previous one and the
+        evaluator is free to take it, so every checkpoint saved is evaluated.
+        The actors and the evaluator load the accepted networks from their
+        own checkpoint files, which are never written again; best.pth.tar is
+        replaced as a whole, for the runs resumed from it.
+
+        The examples of the games finished between two checkpoints make one
+        entry of trainExamplesHistory (with args.replayBuffer they go to the
+        replay buffer as they come). It stops once numIters checkpoints have
+        been evaluated.
+        """
+        folder = self.args.checkpoint
+        roundsPerCheckpoint = getattr(self.args, 'trainRoundsPerCheckpoint', 1)
+        gamesPerRound = getattr(self.args, 'gamesPerTrainRound', None) or self.args.numEps
+        i = 1
+        while os.path.exists(self.nnet.get_filepath(folder, self.getCheckpointFile(i))):
+            i += 1
+
+        self.openReplayBuffer()
+        best = 'best.pth.tar'  # file of the last accepted network
+        self.saveBest(self.nnet)
+        checkpoint = self.selfPlayWeights(folder, best)
+        self.selfPlayFailures = 0
+        evaluator = workerPool(1)
+        evaluation = None  # (future of evaluateCheckpoint, iteration of the checkpoint) in progress
+        evaluated = 0
+        episodes = set()  # futures of the queued episodes
+        examples = deque([], maxlen=self.args.maxlenOfQueue)  # examples of the games since the last checkpoint
+        games = 0
+        newGames = 0  # games finished since the last call of nnet.train
+        rounds = 0  # calls of nnet.train since the last checkpoint
+        trained = False
+        try:
+            while evaluated < self.args.numIters:
+                # actors
+                while len(episodes) < self.args.numEps:
+                    episodes.add(self.submitEpisode(checkpoint))
+                # train on fresh games only, or right away on the examples loaded
+                canTrain = ((newGames >= gamesPerRound and (games >= self.args.numEps or self.skipFirstSelfPlay))
+                            or (self.skipFirstSelfPlay and not trained))
+                pending = episodes | ({evaluation[0]} if evaluation is not None else set())
+                done, _ = wait(pending, timeout=0 if canTrain else None, return_when=FIRST_COMPLETED)
+                try:
+                    for future in done & episodes:
+                        episodes.remove(future)
+                        result = self.episodeResult(future)
+                        if result is None:
+                            continue
+                        if self.replayBuffer is not None:
+                            self.replayBuffer.extend(result)
+                        else:
+                            examples += result
+                        games += 1
+                        newGames += 1
+                except BrokenProcessPool:
+                    # a worker died: the episodes still queued are failed too
+                    episodes = set()
+                    self.restartSelfPlayWorkers()
+
+                # evaluator
+                if evaluation is not None and evaluation[0].done():
+                    (future, iteration), evaluation = evaluation, None
+                    evaluated += 1
+                    pwins, nwins, draws, accepted = future.result()
+                    log.info(f'Checkpoint #{iteration}: NEW/PREV WINS : {nwins} / {pwins} ; DRAWS : {draws}')
+                    if not accepted:
+                        log.info('REJECTING NEW MODEL')
+                    else:
+                        log.info('ACCEPTING NEW MODEL')
+                        best = self.getCheckpointFile(iteration)
+                        if self.pnet is None:
+                            self.pnet = self.nnet.__class__(self.game)
+                        self.pnet.load_checkpoint(folder=folder, filename=best)
+                        self.saveBest(self.pnet)
+                        checkpoint = self.selfPlayWeights(folder, best)
+                if evaluation is None and rounds >= roundsPerCheckpoint and evaluated < self.args.numIters:
+                    log.info(f'Saving checkpoint #{i} after {rounds} training rounds and {games} self-play games')
+                    if self.replayBuffer is None:
+                        if examples:
+                            self.trainExamplesHistory.append(examples)
+                            examples = deque([], maxlen=self.args.maxlenOfQueue)
+                        if len(self.trainExamplesHistory) > self.args.numItersForTrainExamplesHistory:
+                            self.trainExamplesHistory.pop(0)
+                        self.saveTrainExamples(i - 1)
+                    self.nnet.save_checkpoint(folder=folder, filename=self.getCheckpointFile(i))
+                    evaluation = (evaluator.submit(evaluateCheckpoint, self.game, self.nnet.__class__, self.args,
+                                                   folder, self.getCheckpointFile(i), best), i)
+                    i += 1
+                    rounds = 0
+                    if self.resignThreshold is not None:
+                        self.calibrateResignation()
+                    if getattr(self.args, 'collectStats', False):
+                        self.logStats('Self-play', aggregateStats(self.selfPlayStats))
+                        self.selfPlayStats = []
+
+                # learner
+                if not canTrain:
+                    continue
+                if self.replayBuffer is not None:
+                    trainExamples = self.replayBuffer
+                else:
+                    trainExamples = [e for history in self.trainExamplesHistory for e in history] + list(examples)
+                    shuffle(trainExamples)
+                self.nnet.train(trainExamples)
+                rounds += 1
+                newGames = 0
+                trained = True
+        finally:
+            evaluator.shutdown(cancel_futures=True)
+            self.closeSelfPlayWorkers()
+            if self.inferenceServer is not None:
+                self.inferenceServer.close()
+                self.inferenceServer = None
+
+    def saveBest(self, nnet):
+        """
+        Saves nnet as best.pth.tar in args.checkpoint, through a temporary
+        file replacing it at once, so that the file is never read half
+        written.
+        """
+        folder = self.args.checkpoint
+        nnet.save_checkpoint(folder=folder, filename='best.tmp.pth.tar')
+        os.replace(nnet.get_filepath(folder, 'best.tmp.pth.tar'), nnet.get_filepath(folder, 'best.pth.tar'))
+
+    def calibrateResignation(self):
+        """
+        Sets self.resignThreshold to the highest threshold at which at most a
+        fraction args.resignFalsePositives (default 0.05) of the recent games
+        played to the end would have been resigned by a player that did not
+        lose, and never above 0. The threshold is kept as it is until there are
+        enough such games to measure that fraction.
+
+        Returns:
+            falsePositives: the fraction of the recent games played to the end
+                            that the previous threshold would have resigned
+                            wrongly, None without any such game
+        """
+        if not self.resignChecks:
+            return None
+        checks = sorted(self.resignChecks)
+        falsePositives = sum(c < self.resignThreshold for c in checks) / len(checks)
+        target = getattr(self.args, 'resignFalsePositives', 0.05)
+        if len(checks) * target >= 1:
+            # resigning below checks[k] is wrong in at most k of the games
+            self.resignThreshold = min(checks[int(len(checks) * target)], 0.)
+        return falsePositives
+
+    def logStats(self, name, stats):
+        """
+        Logs the search statistics aggregated by MCTS.aggregateStats.
+        """
+        searches = max(stats['searches'], 1)
+        log.info(f"{name} search: {stats['searches']} searches, {stats['simulations'] / searches:.1f} sims "
+                 f"({stats['simulationsSaved'] / searches:.1f} saved by early stopping) "
+                 f"and {stats['expanded'] / searches:.1f} new nodes per search, depth {stats['meanDepth']:.1f} "
+                 f"(max {stats['maxDepth']}), {stats['cacheHits']} cache hits; "
+                 f"time {stats['time']:.1f}s = {stats['evaluateTime']:.1f}s evaluation + "
+                 f"{stats['gameTime']:.1f}s game + {stats['selectionTime']:.1f}s selection")
+
+    def logInferenceStats(self, stats):
+        """
+        Logs the batch size and queue latency histograms of the inference
+        server, see InferenceServer.stats.
+        """
+        log.info(f"Inference server: {stats['requests']} requests, {stats['boards']} boards in "
+                 f"{stats['batches']} batches ({stats['boards'] / max(stats['batches'], 1):.1f} boards per batch)")
+        log.info('Batch sizes: ' + ', '.join(f'<={bound}: {count}' for bound, count in stats['batchSizes']))
+        log.info('Queue latency: ' + ', '.join(f'<={bound * 1000:g}ms: {count}' for bound, count in stats['queueLatency']))
 
     def getCheckpointFile(self, iteration):
         return 'checkpoint_' + str(iteration) + '.pth.tar'
@@ -148,7 +726,33 @@ class Coach():
             Pickler(f).dump(self.trainExamplesHistory)
         f.closed
 
+    def openReplayBuffer(self):
+        """
+        With args.replayBuffer, opens the replay buffer in args.checkpoint
+        (reopening the one of a previous run if there is one) that keeps the
+        examples in place of trainExamplesHistory. It holds
+        args.replayBufferSize examples, by default as many as
+        numItersForTrainExamplesHistory iterations of maxlenOfQueue examples.
+        """
+        if getattr(self.args, 'replayBuffer', False) and self.replayBuffer is None:
+            capacity = getattr(self.args, 'replayBufferSize', None) or \
+                self.args.maxlenOfQueue * self.args.numItersForTrainExamplesHistory
+            self.replayBuffer = ReplayBuffer(os.path.join(self.args.checkpoint, 'replay'), capacity)
+
     def loadTrainExamples(self):
+        """
+        Loads the examples saved with the model. With args.replayBuffer they
+        are those of the replay buffer; if it is still empty, the pickled
+        trainExamplesHistory saved with the model by a run without the replay
+        buffer is imported into it.
+        """
+        self.openReplayBuffer()
+        if self.replayBuffer is not None and len(self.replayBuffer) > 0:
+            log.info(f'Replay buffer holds {len(self.replayBuffer)} examples')
+            # examples based on the model were already collected
+            self.skipFirstSelfPlay = True
+            return
+
         modelFile = os.path.join(self.args.load_folder_file[0], self.args.load_folder_file[1])
         examplesFile = modelFile + ".examples"
         if not os.path.isfile(examplesFile):
@@ -161,6 +765,11 @@ class Coach():
             with open(examplesFile, "rb") as f:
                 self.trainExamplesHistory = Unpickler(f).load()
             log.info('Loading done!')
+            if self.replayBuffer is not None:
+                for examples in self.trainExamplesHistory:
+                    self.replayBuffer.extend(list(examples))
+                self.trainExamplesHistory = []
+                log.info(f'Imported them into the replay buffer, which holds {len(self.replayBuffer)} examples')
 
             # examples based on the model were already collected (loaded)
             self.skipFirstSelfPlay = True
\ No newline at end of file
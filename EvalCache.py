@@ -0,0 +1,83 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class EvalCache():
+    """
+    Size-bounded cache of neural network evaluations, keyed by the model
+    version of the network (see NeuralNet.modelVersion) and the key of the
+    board (see Game.hashState). Since the version changes whenever the
+    weights do, stale evaluations are never returned; they are evicted, least
+    recently used first, like any other entry once the cache is full.
+
+    A single cache is shared by all MCTS instances of the process, see
+    sharedEvalCache, so positions seen by several searches (the opening
+    positions of self-play games, the two players of an Arena, ...) are
+    evaluated only once per model version.
+    """
+
+    def __init__(self, maxEntries):
+        self.maxEntries = maxEntries
+        self.entries = OrderedDict()  # (model version, s) -> (pi, v)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, version, s):
+        """
+        Returns:
+            (pi, v) cached for the board with key s under the model version,
+            or None
+        """
+        key = (version, s)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, version, s, pi, v):
+        # copy pi, which may be a row of a whole batch of predictions
+        self.entries[(version, s)] = (np.array(pi), v)
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+
+    def resize(self, maxEntries):
+        self.maxEntries = maxEntries
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        """
+        Returns the number of entries and the lookup counters since the last
+        resetStats.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / lookups if lookups else 0.,
+        }
+
+    def resetStats(self):
+        self.hits = 0
+        self.misses = 0
+
+
+_sharedEvalCache = None
+
+
+def sharedEvalCache(maxEntries):
+    """
+    Returns the evaluation cache of the process, created on first use and
+    resized to maxEntries entries.
+    """
+    global _sharedEvalCache
+    if _sharedEvalCache is None:
+        _sharedEvalCache = EvalCache(maxEntries)
+    elif _sharedEvalCache.maxEntries != maxEntries:
+        _sharedEvalCache.resize(maxEntries)
+    return _sharedEvalCache
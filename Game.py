@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class Game():
     """
     This class specifies the base Game class. To define your own game, subclass
@@ -46,6 +49,35 @@ class Game():
         """
         pass
 
+    def applyInPlace(self, board, action):
+        """
+        Optional faster path for MCTS, which (with args.inPlaceDescent) walks
+        down its tree by applying moves to a single board and undoing them
+        afterwards instead of copying the board at every step. Games that do
+        not implement it are searched with getNextState and getCanonicalForm.
+
+        Input:
+            board: a board in its canonical form, modified in place
+            action: action taken by player 1
+
+        Returns:
+            undoInfo: what undo needs to restore board. Once applyInPlace
+                      returns, board equals what
+                      getCanonicalForm(*getNextState(board, 1, action))
+                      would have returned.
+        """
+        raise NotImplementedError
+
+    def undo(self, board, undoInfo):
+        """
+        Input:
+            board: the board modified by applyInPlace
+            undoInfo: the value returned by applyInPlace
+
+        Restores board, in place, to what it was before applyInPlace.
+        """
+        raise NotImplementedError
+
     def getValidMoves(self, board, player):
         """
         Input:
@@ -59,6 +91,22 @@ class Game():
         """
         pass
 
+    def getValidActions(self, board, player):
+        """
+        Input:
+            board: current board
+            player: current player
+
+        Returns:
+            validActions: the sorted indices of the moves that are valid from
+                          the current board and player. MCTS only stores these
+                          actions in its nodes. The default implementation
+                          takes the nonzero entries of getValidMoves; games
+                          with a large action space can list their moves
+                          directly instead of building the dense vector.
+        """
+        return np.flatnonzero(self.getValidMoves(board, player))
+
     def getGameEnded(self, board, player):
         """
         Input:
@@ -101,6 +149,24 @@ class Game():
         """
         pass
 
+    def getCanonicalSymmetry(self, board):
+        """
+        Input:
+            board: current board
+
+        Returns:
+            symBoard: the representative of the symmetrical forms of board (see
+                      getSymmetries), the same board for all of them. MCTS
+                      searches it instead of board when args.symmetryKeys is
+                      set, so that symmetrical positions share one node.
+            perm: an array of size self.getActionSize() where perm[a] is the
+                  action on symBoard corresponding to action a on board, or
+                  None if symBoard is board
+
+        The default implementation does not merge symmetrical positions.
+        """
+        return board, None
+
     def stringRepresentation(self, board):
         """
         Input:
@@ -111,3 +177,42 @@ class Game():
                          Required by MCTS for hashing.
         """
         pass
+
+    def hashState(self, board):
+        """
+        Input:
+            board: current board
+
+        Returns:
+            key: a hashable key identifying board, used by MCTS to store its
+                 nodes. The default implementation returns
+                 stringRepresentation(board). Games can return instead a 64-bit
+                 Zobrist hash maintained incrementally in getNextState, which
+                 is cheaper to compute, hash and store.
+        """
+        return self.stringRepresentation(board)
+
+
+def squareBoardSymmetry(board, n):
+    """
+    Game.getCanonicalSymmetry for an n x n board whose actions are the n*n
+    squares followed by a pass: the representative is the form with the
+    smallest string representation among the 8 rotations and reflections.
+    """
+    indices = np.arange(n**2).reshape(n, n)
+    best = None
+    for i in range(1, 5):
+        for j in [True, False]:
+            newB = np.rot90(board, i)
+            newIndices = np.rot90(indices, i)
+            if j:
+                newB = np.fliplr(newB)
+                newIndices = np.fliplr(newIndices)
+            key = newB.tobytes()
+            if best is None or key < best[0]:
+                best = (key, newB, newIndices)
+    _, symBoard, symIndices = best
+    perm = np.empty(n**2 + 1, dtype=np.int64)
+    perm[symIndices.ravel()] = np.arange(n**2)
+    perm[-1] = n**2  # pass
+    return np.ascontiguousarray(symBoard), perm
@@ -0,0 +1,384 @@
+import logging
+import pickle
+import queue
+import shutil
+import tempfile
+import time
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from NeuralNet import NeuralNet
+from utils import dotdict, spawnContext
+
+log = logging.getLogger(__name__)
+
+POLL_INTERVAL = 1.  # seconds between the checks that the server is still alive while a client waits for it
+# upper bounds of the buckets of the queue latency histogram, in seconds
+LATENCY_BUCKETS = [1e-4, 2e-4, 5e-4, 1e-3, 2e-3, 5e-3, 1e-2, 2e-2, 5e-2, 1e-1, 2e-1, 5e-1, np.inf]
+
+
+def sharedLayout(slots, requestBytes, slotBoards, actionSize):
+    """
+    Lays out the shared memory of an InferenceServer. Every slot holds one
+    request at a time: its header (size of the pickled boards, number of
+    boards, time.time() at which it was queued, 1 if the server failed to
+    evaluate them else 0), the pickled boards and, once evaluated, their
+    policies and values. The version counts the weights the server has
+    loaded.
+
+    Returns:
+        layout: a list of (name, dtype, shape) of the arrays, in order
+    """
+    return [('version', np.int64, (1,)),
+            ('headers', np.float64, (slots, 4)),
+            ('pis', np.float32, (slots, slotBoards, actionSize)),
+            ('vs', np.float32, (slots, slotBoards)),
+            ('requests', np.uint8, (slots, requestBytes))]
+
+
+def sharedBytes(shape):
+    return sum(np.dtype(dtype).itemsize * int(np.prod(size)) for _, dtype, size in sharedLayout(*shape))
+
+
+def sharedArrays(buf, shape):
+    """
+    Returns:
+        arrays: a dotdict of the numpy arrays of sharedLayout(*shape) over buf
+    """
+    arrays = dotdict()
+    offset = 0
+    for name, dtype, size in sharedLayout(*shape):
+        arrays[name] = np.ndarray(size, dtype=dtype, buffer=buf, offset=offset)
+        offset += arrays[name].nbytes
+    return arrays
+
+
+class InferenceServer():
+    """
+    Process that owns the only instance of the neural network of the
+    self-play workers (see Coach.executeEpisodesParallel with
+    args.inferenceServer) and evaluates their boards in dynamic batches.
+
+    The boards and the predictions go through shared memory, split into
+    args.inferenceSlots slots (default two per self-play worker) that are
+    reused in turn like a ring buffer; only slot numbers go through queues.
+    The server waits for up to args.inferenceMaxWait seconds (default 0.002)
+    after the first request for more of them, and evaluates at most
+    args.inferenceMaxBatch boards (default 256) in one nnet.predictBatch
+    call.
+
+    A slot holds at most args.inferenceSlotBoards boards (default
+    inferenceMaxBatch split evenly between the slots), so that the
+    predictions of all the slots take as much shared memory as one full
+    batch; clients split larger requests. Creating a server that needs more
+    than args.inferenceMaxBytes (default 1 GiB) of shared memory raises
+    ValueError.
+
+    Workers use it through an InferenceClient (see client), which is a
+    NeuralNet, so MCTS does not know whether it is used.
+
+    A batch the network fails to evaluate fails the requests in it, and a
+    request fails if the server process dies while it waits: the client
+    raises RuntimeError, so the episode of the worker fails instead of
+    hanging.
+    """
+
+    def __init__(self, game, nnet, args):
+        self.maxBatch = getattr(args, 'inferenceMaxBatch', 256)
+        slots = getattr(args, 'inferenceSlots', None) or 2 * getattr(args, 'selfPlayWorkers', 1)
+        requestBytes = getattr(args, 'inferenceRequestBytes', 1 << 20)
+        slotBoards = getattr(args, 'inferenceSlotBoards', None) or max(1, self.maxBatch // slots)
+        self.shape = (slots, requestBytes, min(slotBoards, self.maxBatch), game.getActionSize())
+        size = sharedBytes(self.shape)
+        maxBytes = getattr(args, 'inferenceMaxBytes', 1 << 30)
+        if size > maxBytes:
+            raise ValueError(f'The inference server needs {size} bytes of shared memory for {slots} slots of '
+                             f'{self.shape[2]} boards of {self.shape[3]} actions, more than args.inferenceMaxBytes '
+                             f'({maxBytes}): lower args.inferenceSlotBoards, args.inferenceSlots or '
+                             f'args.inferenceRequestBytes')
+        self.shm = SharedMemory(create=True, size=size)
+        sharedArrays(self.shm.buf, self.shape).version[0] = -1
+        self.version = None  # model version of the parent network whose weights the server has
+        self.folder = tempfile.mkdtemp(prefix='inference_')
+
+        context = spawnContext()
+        self.ready = context.Queue()  # numbers of the slots holding a request, and commands
+        self.free = context.Queue()  # numbers of the slots free for a request
+        for slot in range(slots):
+            self.free.put(slot)
+        self.done = [context.Semaphore(0) for _ in range(slots)]  # released once a request is evaluated
+        self.connection, serverConnection = context.Pipe()
+        # the server holds the only writing end: reading it gives EOF once the server is gone
+        self.lifeline, lifelineEnd = context.Pipe(duplex=False)
+        self.process = context.Process(target=inferenceServer, daemon=True,
+                                       args=(game, nnet.__class__, self.shm.name, self.shape, self.ready,
+                                             self.free, self.done, serverConnection, lifelineEnd, args))
+        self.process.start()
+        serverConnection.close()
+        lifelineEnd.close()
+
+    def client(self):
+        """
+        Returns:
+            client: an InferenceClient for this server, to be handed to a
+                    worker process when it is started
+        """
+        return InferenceClient(self.shm.name, self.shape, self.ready, self.free, self.done, self.lifeline)
+
+    def load(self, nnet):
+        """
+        Gives the server the current weights of nnet, unless it already has
+        them. The weights go through a temporary checkpoint.
+        """
+        if self.version == nnet.modelVersion():
+            return
+        filename = 'inference.pth.tar'
+        nnet.save_checkpoint(folder=self.folder, filename=filename)
+        self.loadCheckpoint(self.folder, filename)
+        self.version = nnet.modelVersion()
+
+    def loadCheckpoint(self, folder, filename):
+        """
+        Gives the server the weights saved in folder/filename.
+        """
+        self.version = None
+        self.command('load', folder, filename)
+
+    def stats(self):
+        """
+        Returns:
+            stats: the number of requests, batches and boards evaluated since
+                   the last call, and the histograms of the batch sizes (in
+                   boards) and of the time requests waited in the queue (in
+                   seconds), as lists of (bucket upper bound, count)
+        """
+        return self.command('stats')
+
+    def resetSlots(self):
+        """
+        Frees all the slots. Call it when no worker is running anymore, to
+        recover the slots of workers that died during a request.
+        """
+        self.command('reset')
+
+    def command(self, *command):
+        """
+        Sends a command to the server and returns its answer, raising the
+        exception the command raised in the server, if any, or EOFError if
+        the server is gone.
+        """
+        self.ready.put(command)
+        answer = self.connection.recv()
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    def close(self):
+        if self.process is not None:
+            self.ready.put(None)
+            self.process.join()
+            self.process = None
+            self.shm.close()
+            self.shm.unlink()
+            shutil.rmtree(self.folder, ignore_errors=True)
+
+
+class InferenceClient(NeuralNet):
+    """
+    NeuralNet whose predictions are computed by an InferenceServer. It can
+    only predict: the server gets its weights from InferenceServer.load.
+    """
+
+    def __init__(self, shmName, shape, ready, free, done, lifeline):
+        self.shmName = shmName
+        self.shape = shape
+        self.ready = ready
+        self.free = free
+        self.done = done
+        self.lifeline = lifeline
+        self.shm = None
+        self.arrays = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shm'] = None
+        state['arrays'] = None
+        return state
+
+    def attach(self):
+        if self.arrays is None:
+            self.shm = SharedMemory(name=self.shmName)
+            self.arrays = sharedArrays(self.shm.buf, self.shape)
+        return self.arrays
+
+    def modelVersion(self):
+        """
+        Returns:
+            version: a key identifying the weights the server currently has,
+                     unique across processes
+        """
+        return (self.shmName, int(self.attach().version[0]))
+
+    def predict(self, board):
+        pis, vs = self.predictBatch([board])
+        return pis[0], vs[0]
+
+    def predictBatch(self, boards):
+        slotBoards = self.shape[2]
+        predictions = [self.request(boards[start:start + slotBoards]) for start in range(0, len(boards), slotBoards)]
+        return np.concatenate([pis for pis, _ in predictions]), np.concatenate([vs for _, vs in predictions])
+
+    def request(self, boards):
+        """
+        Sends boards (at most slotBoards of them) to the server through a free
+        slot and waits for their evaluation. Raises RuntimeError if the
+        server fails to evaluate them or dies.
+
+        Returns:
+            pis, vs: as returned by nnet.predictBatch
+        """
+        arrays = self.attach()
+        data = pickle.dumps(boards, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.shape[1]:
+            raise ValueError(f'{len(boards)} boards take {len(data)} bytes, more than args.inferenceRequestBytes')
+        slot = self.free.get()
+        arrays.requests[slot, :len(data)] = np.frombuffer(data, dtype=np.uint8)
+        arrays.headers[slot] = len(data), len(boards), time.time(), 0
+        self.ready.put(slot)
+        while not self.done[slot].acquire(timeout=POLL_INTERVAL):
+            if self.lifeline.poll():
+                raise RuntimeError('The inference server died')
+        if arrays.headers[slot, 3] != 0:
+            self.free.put(slot)
+            raise RuntimeError('The inference server failed to evaluate the boards, see its log')
+        pis = arrays.pis[slot, :len(boards)].copy()
+        vs = arrays.vs[slot, :len(boards)].copy()
+        self.free.put(slot)
+        return pis, vs
+
+
+class ServerStats():
+    """
+    Batch size and queue latency histograms of an InferenceServer.
+    """
+
+    def __init__(self, maxBatch):
+        self.batchBuckets = [2 ** k for k in range(int(np.log2(maxBatch)) + 1)]
+        if self.batchBuckets[-1] < maxBatch:
+            self.batchBuckets.append(maxBatch)
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.batches = 0
+        self.boards = 0
+        self.batchSizes = np.zeros(len(self.batchBuckets), dtype=np.int64)
+        self.latencies = np.zeros(len(LATENCY_BUCKETS), dtype=np.int64)
+
+    def record(self, boards, latencies):
+        self.requests += len(latencies)
+        self.batches += 1
+        self.boards += boards
+        self.batchSizes[np.searchsorted(self.batchBuckets, boards)] += 1
+        for latency in latencies:
+            self.latencies[np.searchsorted(LATENCY_BUCKETS, latency)] += 1
+
+    def asDict(self):
+        return {
+            'requests': self.requests,
+            'batches': self.batches,
+            'boards': self.boards,
+            'batchSizes': list(zip(self.batchBuckets, self.batchSizes.tolist())),
+            'queueLatency': list(zip(LATENCY_BUCKETS, self.latencies.tolist())),
+        }
+
+
+def inferenceServer(game, nnetClass, shmName, shape, ready, free, done, connection, lifeline, args):
+    """
+    Main loop of the InferenceServer process. It receives slot numbers and
+    commands ('load', folder, filename), ('stats',) and ('reset',) through
+    ready, answering commands through connection (with the exception they
+    raised, if any), until it receives None. The process keeps lifeline
+    open, so that clients notice when it is gone.
+    """
+    nnet = nnetClass(game)
+    shm = SharedMemory(name=shmName)
+    arrays = sharedArrays(shm.buf, shape)
+    slots = shape[0]
+    maxBatch = getattr(args, 'inferenceMaxBatch', 256)
+    maxWait = getattr(args, 'inferenceMaxWait', 0.002)
+    stats = ServerStats(maxBatch)
+    pending = None  # a message that did not fit in the previous batch
+
+    while True:
+        message = ready.get() if pending is None else pending
+        pending = None
+        if message is None:
+            break
+        if isinstance(message, tuple):
+            try:
+                answer = None
+                if message[0] == 'load':
+                    nnet.load_checkpoint(folder=message[1], filename=message[2])
+                    arrays.version[0] += 1
+                elif message[0] == 'stats':
+                    answer = stats.asDict()
+                    stats.reset()
+                elif message[0] == 'reset':
+                    while True:
+                        try:
+                            free.get_nowait()
+                        except queue.Empty:
+                            break
+                    for slot in range(slots):
+                        while done[slot].acquire(block=False):
+                            pass
+                        free.put(slot)
+            except Exception as e:
+                log.exception(f'Inference server command {message[0]} failed')
+                answer = e
+            connection.send(answer)
+            continue
+
+        # gather requests until the batch is full or maxWait has passed
+        batch = [message]
+        count = int(arrays.headers[message, 1])
+        deadline = time.time() + maxWait
+        while count < maxBatch:
+            try:
+                message = ready.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                break
+            if message is None or isinstance(message, tuple) or count + arrays.headers[message, 1] > maxBatch:
+                pending = message
+                break
+            batch.append(message)
+            count += int(arrays.headers[message, 1])
+
+        start = time.time()
+        try:
+            boards = []
+            for slot in batch:
+                size = int(arrays.headers[slot, 0])
+                boards += pickle.loads(arrays.requests[slot, :size].tobytes())
+            pis, vs = nnet.predictBatch(boards)
+            pis = np.asarray(pis)
+            vs = np.asarray(vs).reshape(-1)
+        except Exception:
+            log.exception(f'Inference server failed to evaluate a batch of {count} boards')
+            for slot in batch:
+                arrays.headers[slot, 3] = 1
+                done[slot].release()
+            continue
+        offset = 0
+        for slot in batch:
+            size = int(arrays.headers[slot, 1])
+            arrays.pis[slot, :size] = pis[offset:offset + size]
+            arrays.vs[slot, :size] = vs[offset:offset + size]
+            offset += size
+            done[slot].release()
+        stats.record(count, [start - arrays.headers[slot, 2] for slot in batch])
+
+    del arrays
+    shm.close()
@@ -1,12 +1,295 @@
+import atexit
+import json
 import logging
 import math
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
 
 import numpy as np
 
+from EvalCache import sharedEvalCache
+from Game import Game
+from utils import spawnContext
+
 EPS = 1e-8
+REPETITION = 1e-4  # value of a board that repeats a board earlier on the descent path, scored like a draw
 
 log = logging.getLogger(__name__)
 
+_warnedRootParallel = False  # whether getActionProbSteps warned that it ignores args.rootParallelWorkers
+
+
+class MCTSNode():
+    """
+    Statistics of one state of the search tree. Only valid actions are stored,
+    as contiguous arrays that are indexed by the position of the action in
+    self.actions, so that selection at a node is a single vectorized argmax.
+    """
+    __slots__ = ('ended', 'actions', 'P', 'V', 'N', 'Q', 'Ns', 'VL', 'pending', 'children', 'proven', 'provenEdges')
+
+    def __init__(self, ended=0, actions=None, P=None, V=0.):
+        self.ended = ended  # game.getGameEnded for the state
+        self.actions = actions  # indices of the valid actions
+        self.P = P  # initial policy (returned by neural net) over self.actions
+        self.V = V  # value of the state returned by neural net
+        self.N = None  # stores #times edge s,a was visited
+        self.Q = None  # stores Q values for s,a (as defined in the paper)
+        self.Ns = 0  # stores #times board s was visited
+        self.VL = None  # stores #descents through s,a still waiting for their leaf value
+        self.pending = 0  # stores #descents through s still waiting for their leaf value
+        self.children = None  # stores the key (game.hashState) of the board after s,a
+        self.proven = ended if abs(ended) == 1 else 0  # 1 (-1) if s is proven won (lost) for the player to move
+        self.provenEdges = None  # stores the proven value of the board after s,a, for the player to move there
+        if actions is not None:
+            self.children = {}
+            self.N = np.zeros(len(actions), dtype=np.int64)
+            self.Q = np.zeros(len(actions), dtype=np.float64)
+
+    def selectAction(self, cpuct, virtualLoss=0):
+        """
+        Returns the index into self.actions of the action with the highest
+        upper confidence bound. Descents that are still waiting for their leaf
+        value count as visits that lost virtualLoss each, which steers
+        concurrent descents towards different leaves.
+        """
+        N, Q, Ns = self.N, self.Q, self.Ns
+        if self.pending:
+            N = self.N + self.VL
+            Q = np.where(N > 0, (self.N * self.Q - virtualLoss * self.VL) / np.maximum(N, 1), 0)
+            Ns = self.Ns + self.pending
+
+        u = np.where(N > 0,
+                     Q + cpuct * self.P * math.sqrt(Ns) / (1 + N),
+                     cpuct * self.P * math.sqrt(Ns + EPS))  # Q = 0 ?
+        if self.provenEdges is not None:
+            # never play into a position proven won for the opponent
+            u[self.provenEdges == 1] = -np.inf
+        return int(np.argmax(u))
+
+    def addVirtualLoss(self, i):
+        if self.VL is None:
+            self.VL = np.zeros(len(self.actions), dtype=np.int64)
+        self.VL[i] += 1
+        self.pending += 1
+
+    def removeVirtualLoss(self, i):
+        self.VL[i] -= 1
+        self.pending -= 1
+
+    def update(self, i, v):
+        """
+        Backs up value v through the edge self.actions[i].
+        """
+        self.Q[i] = (self.N[i] * self.Q[i] + v) / (self.N[i] + 1)
+        self.N[i] += 1
+        self.Ns += 1
+
+    def markProven(self, i, proven):
+        """
+        Records that the board after self.actions[i] is proven won (proven = 1)
+        or lost (proven = -1) for the player to move there. The node is proven
+        won as soon as one action leads to a lost board, and proven lost once
+        all actions lead to won boards.
+
+        Returns:
+            proven: the proven value of the node, 0 if it is not proven
+        """
+        if self.provenEdges is None:
+            self.provenEdges = np.zeros(len(self.actions), dtype=np.int8)
+        self.provenEdges[i] = proven
+        if proven == -1:
+            self.proven = 1
+        elif np.all(self.provenEdges == 1):
+            self.proven = -1
+        return self.proven
+
+    def completedQ(self):
+        """
+        Returns the Q values of the actions, completed for the unvisited ones
+        with an estimate of the value of the node that mixes V with the Q
+        values of the visited actions (weighted by their prior).
+        """
+        visited = self.N > 0
+        if not visited.any():
+            return np.full(len(self.actions), self.V)
+        Ns = self.N.sum()
+        P = self.P[visited]
+        vMix = (self.V + Ns * np.dot(P, self.Q[visited]) / max(P.sum(), EPS)) / (1 + Ns)
+        return np.where(visited, self.Q, vMix)
+
+    def value(self):
+        """
+        Returns the value of the state for the player to move: its proven
+        value, or the mean of V and of the values backed up through its edges.
+        """
+        if self.proven != 0:
+            return float(self.proven)
+        return float((self.V + np.dot(self.N, self.Q)) / (1 + self.Ns))
+
+    def nbytes(self):
+        """
+        Returns an estimate of the memory held by the node, counting its
+        arrays and one child entry per valid action.
+        """
+        size = sys.getsizeof(self)
+        if self.actions is not None:
+            size += self.actions.nbytes + self.P.nbytes + self.N.nbytes + self.Q.nbytes
+            size += sys.getsizeof({}) + 64 * len(self.actions)
+        return size
+
+    def counts(self, actionSize):
+        """
+        Returns the visit counts as a dense vector of length actionSize.
+        """
+        counts = np.zeros(actionSize, dtype=np.int64)
+        counts[self.actions] = self.N
+        return counts
+
+
+def probsFromCounts(counts, temp):
+    """
+    Returns:
+        probs: a policy vector where the probability of the ith action is
+               proportional to counts[i]**(1./temp), or the most visited action
+               (ties broken at random) if temp is 0
+    """
+    if temp == 0:
+        bestAs = np.array(np.argwhere(counts == np.max(counts))).flatten()
+        bestA = np.random.choice(bestAs)
+        probs = [0] * len(counts)
+        probs[bestA] = 1
+        return probs
+
+    counts = [x ** (1. / temp) for x in counts]
+    counts_sum = float(sum(counts))
+    probs = [x / counts_sum for x in counts]
+    return probs
+
+
+def fromSymmetry(probs, perm):
+    """
+    Returns:
+        probs: the policy vector probs over the actions of a representative
+               board (see Game.getCanonicalSymmetry) as a policy vector over
+               the actions of the board perm was returned for
+    """
+    if perm is None:
+        return probs
+    return [probs[a] for a in perm]
+
+
+def copyBoard(board):
+    """
+    Returns a copy of board, an array (or a dict) or a tuple of them, that
+    later moves applied in place to board leave unchanged.
+    """
+    if isinstance(board, tuple):
+        return tuple(copyBoard(part) for part in board)
+    return board.copy()
+
+
+class TimedGame():
+    """
+    Forwards every call to game, adding the time spent in it to self.time.
+    MCTS uses it in place of the game when args.collectStats is set.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.time = 0.
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name == 'game':
+            raise AttributeError(name)
+        attr = getattr(self.game, name)
+        if not callable(attr):
+            return attr
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self.time += time.perf_counter() - start
+        return timed
+
+
+class SearchStats():
+    """
+    Counters of one search, collected when args.collectStats is set.
+    """
+
+    def __init__(self, gameTime=0.):
+        self.start = time.perf_counter()
+        self.gameStart = gameTime
+        self.expanded = 0  # leaves evaluated and added to the tree
+        self.cacheHits = 0  # leaves evaluated from the evaluation cache
+        self.descents = 0
+        self.depthSum = 0
+        self.maxDepth = 0
+        self.evaluateTime = 0.  # time spent waiting for leaf evaluations
+
+    def addDescent(self, depth):
+        self.descents += 1
+        self.depthSum += depth
+        self.maxDepth = max(self.maxDepth, depth)
+
+    def asDict(self, gameTime):
+        """
+        Returns the statistics of the search, gameTime being the time spent in
+        the methods of the game since the search started (see TimedGame).
+        Whatever time is left is spent on selection, backups and bookkeeping.
+        """
+        total = time.perf_counter() - self.start
+        gameTime -= self.gameStart
+        return {
+            'expanded': self.expanded,
+            'cacheHits': self.cacheHits,
+            'maxDepth': self.maxDepth,
+            'meanDepth': self.depthSum / self.descents if self.descents else 0.,
+            'time': total,
+            'evaluateTime': self.evaluateTime,
+            'gameTime': gameTime,
+            'selectionTime': total - self.evaluateTime - gameTime,
+        }
+
+
+def aggregateStats(statsList):
+    """
+    Aggregates the statistics of several searches (see MCTS.popStats).
+
+    Returns:
+        stats: the number of searches, the totals of the counters and times,
+               the largest maxDepth and the mean depth over all descents
+    """
+    stats = {'searches': len(statsList)}
+    for key in ['simulations', 'simulationsSaved', 'expanded', 'cacheHits', 'time', 'evaluateTime', 'gameTime',
+                'selectionTime']:
+        stats[key] = sum(s.get(key, 0) for s in statsList)
+    stats['maxDepth'] = max((s.get('maxDepth', 0) for s in statsList), default=0)
+    descents = sum(s.get('simulations', 0) for s in statsList)
+    stats['meanDepth'] = sum(s.get('meanDepth', 0) * s.get('simulations', 0) for s in statsList) / descents if descents else 0.
+    return stats
+
+
+def runSteps(steps, nnet):
+    """
+    Drives a generator such as MCTS.getActionProbSteps, evaluating every list
+    of boards it yields with nnet.predictBatch.
+
+    Returns:
+        the value returned by the generator
+    """
+    try:
+        boards = next(steps)
+        while True:
+            boards = steps.send(nnet.predictBatch(boards))
+    except StopIteration as stop:
+        return stop.value
+
 
 class MCTS():
     """
@@ -14,49 +297,210 @@ class MCTS():
     """
 
     def __init__(self, game, nnet, args):
+        # with args.inPlaceDescent, walk down the tree with Game.applyInPlace if
+        # the game implements it, unless the boards of the descent are replaced
+        # by symmetrical ones. It only pays off where copying a board costs more
+        # than the bookkeeping of undo (Othello, deep trees), so it is opt-in.
+        symmetric = (getattr(args, 'symmetryKeys', False)
+                     and type(game).getCanonicalSymmetry is not Game.getCanonicalSymmetry)
+        self.inPlace = (getattr(args, 'inPlaceDescent', False) and not symmetric
+                        and type(game).applyInPlace is not Game.applyInPlace)
+        if getattr(args, 'collectStats', False):
+            game = TimedGame(game)
         self.game = game
         self.nnet = nnet
         self.args = args
-        self.Qsa = {}  # stores Q values for s,a (as defined in the paper)
-        self.Nsa = {}  # stores #times edge s,a was visited
-        self.Ns = {}  # stores #times board s was visited
-        self.Ps = {}  # stores initial policy (returned by neural net)
+        self.nodes = OrderedDict()  # stores an MCTSNode for every board s seen by the search, least recently used first
+        self.nodesBytes = 0  # estimated memory held by self.nodes and their keys
+
+        # transposition table counters
+        self.hits = 0  # lookups of a board that already had a node
+        self.misses = 0  # lookups of a board without a node
+        self.evictions = 0  # nodes evicted to stay within the budget
 
-        self.Es = {}  # stores game.getGameEnded ended for board s
-        self.Vs = {}  # stores game.getValidMoves for board s
+        self.rootWorkers = None  # RootParallelWorkers, started by the first root-parallel search
+        cacheSize = getattr(args, 'evalCacheSize', 0)
+        self.evalCache = sharedEvalCache(cacheSize) if cacheSize else None  # neural network evaluations shared by all searches
+        self.searchStats = {}  # statistics of the last search
+        self.stats = None  # SearchStats of the search in progress, with args.collectStats
+        self.statsHistory = []  # searchStats of the searches since the last popStats, with args.collectStats
 
     def getActionProb(self, canonicalBoard, temp=1):
         """
         This function performs numMCTSSims simulations of MCTS starting from
-        canonicalBoard.
+        canonicalBoard. If args.timeBudget is set, simulations run until that
+        many seconds have passed instead, see getActionProbTimed.
 
         Returns:
             probs: a policy vector where the probability of the ith action is
                    proportional to Nsa[(s,a)]**(1./temp)
         """
-        for i in range(self.args.numMCTSSims):
-            self.search(canonicalBoard)
+        return self.getActionProbTimed(canonicalBoard, temp)[0]
+
+    def getActionProbTimed(self, canonicalBoard, temp=1, timeBudget=None):
+        """
+        Anytime version of getActionProb. With a timeBudget (in seconds,
+        defaults to args.timeBudget) simulations run until the budget has
+        passed, but at least args.minMCTSSims (default 1) and at most
+        args.maxMCTSSims (default unlimited) of them. Without one it performs
+        numMCTSSims simulations, like getActionProb.
 
-        s = self.game.stringRepresentation(canonicalBoard)
-        counts = [self.Nsa[(s, a)] if (s, a) in self.Nsa else 0 for a in range(self.game.getActionSize())]
+        Returns:
+            probs: as returned by getActionProb
+            sims: the number of simulations that were run
+        """
+        if getattr(self.args, 'rootParallelWorkers', 1) > 1:
+            if self.rootWorkers is None:
+                self.rootWorkers = RootParallelWorkers(self.game, self.nnet, self.args)
+            numSims, minSims, timeBudget = self.simulationBudget(timeBudget)
+            symBoard, perm = self.canonicalSymmetry(canonicalBoard)
+            counts, sims = self.rootWorkers.counts(symBoard, numSims, minSims, timeBudget)
+            if perm is not None:
+                counts = counts[perm]
+            self.searchStats = {'simulations': sims}
+            return probsFromCounts(counts, temp), sims
 
-        if temp == 0:
-            bestAs = np.array(np.argwhere(counts == np.max(counts))).flatten()
-            bestA = np.random.choice(bestAs)
-            probs = [0] * len(counts)
-            probs[bestA] = 1
-            return probs
-
-        counts = [x ** (1. / temp) for x in counts]
-        counts_sum = float(sum(counts))
-        probs = [x / counts_sum for x in counts]
-        return probs
+        probs = runSteps(self.getActionProbSteps(canonicalBoard, temp, timeBudget), self.nnet)
+        return probs, self.searchStats['simulations']
+
+    def getActionProbSteps(self, canonicalBoard, temp=1, timeBudget=None, numSims=None):
+        """
+        Generator version of getActionProbTimed. It yields lists of leaf boards
+        that must be evaluated, expects the (pis, vs) of nnet.predictBatch for
+        each of them to be sent back, and returns probs. This lets a caller
+        evaluate the leaves of several searches together, see runSteps and
+        Coach.executeEpisodesLockstep. The number of simulations run is left in
+        self.searchStats.
+
+        A numSims given overrides both args.numMCTSSims and the time budget:
+        exactly that many simulations are run, see Coach.episodeSteps.
+
+        With args.collectStats self.searchStats also holds the number of new
+        nodes, the depth of the descents, the split of the time between leaf
+        evaluations, game methods and selection, and the evaluation cache hits
+        of the search. It is then appended to self.statsHistory and, if
+        args.statsFile is set, written to that file as one JSON line.
+
+        With args.symmetryKeys the search runs from the representative of the
+        symmetrical forms of canonicalBoard (see Game.getCanonicalSymmetry)
+        and probs is mapped back to the actions of canonicalBoard.
+
+        args.rootParallelWorkers does not apply: the workers evaluate their
+        own leaves, so there would be nothing to yield. The search runs in
+        this process, with a warning the first time.
+        """
+        global _warnedRootParallel
+        if getattr(self.args, 'rootParallelWorkers', 1) > 1 and not _warnedRootParallel:
+            log.warning('args.rootParallelWorkers is ignored by getActionProbSteps (self-play), '
+                        'only getActionProb and getActionProbTimed search with the workers')
+            _warnedRootParallel = True
+        if getattr(self.args, 'collectStats', False):
+            self.stats = SearchStats(self.game.time)
+        canonicalBoard, perm = self.canonicalSymmetry(canonicalBoard)
+        numSims, minSims, timeBudget = self.simulationBudget(timeBudget, numSims)
+        deadline = time.time() + timeBudget if timeBudget is not None else None
+
+        if getattr(self.args, 'reuseSubtree', False):
+            inherited = self.advanceRoot(canonicalBoard)
+            log.debug(f'Inherited {inherited} simulations from the previous search')
+
+        if getattr(self.args, 'gumbelRoot', False):
+            sims, probs = yield from self.gumbelSteps(canonicalBoard, numSims, temp, deadline, minSims)
+            self.searchStats = {'simulations': sims, 'simulationsSaved': 0}
+        else:
+            # with temp=0 only the most visited action matters
+            earlyStop = temp == 0 and getattr(self.args, 'earlyStop', False)
+            sims = yield from self.searchSteps(canonicalBoard, numSims, deadline, minSims, earlyStop)
+            self.searchStats = {'simulations': sims,
+                                'simulationsSaved': numSims - sims if deadline is None else 0}
+            probs = self.actionProb(canonicalBoard, temp)
+
+        if self.stats is not None:
+            self.searchStats.update(self.stats.asDict(self.game.time))
+            self.stats = None
+            self.statsHistory.append(self.searchStats)
+            statsFile = getattr(self.args, 'statsFile', None)
+            if statsFile:
+                with open(statsFile, 'a') as f:
+                    f.write(json.dumps(self.searchStats) + '\n')
+        return fromSymmetry(probs, perm)
+
+    def rootValue(self, canonicalBoard):
+        """
+        Returns:
+            v: the value of canonicalBoard for the player to move, as estimated
+               by the searches from it so far (see MCTSNode.value)
+        """
+        symBoard, _ = self.canonicalSymmetry(canonicalBoard)
+        return self.nodes[self.game.hashState(symBoard)].value()
+
+    def popStats(self):
+        """
+        Returns:
+            statsHistory: the searchStats of every search since the last call,
+                          with args.collectStats (see getActionProbSteps)
+        """
+        statsHistory, self.statsHistory = self.statsHistory, []
+        return statsHistory
+
+    def canonicalSymmetry(self, canonicalBoard):
+        """
+        Returns:
+            symBoard, perm: as returned by game.getCanonicalSymmetry if
+                            args.symmetryKeys is set, else canonicalBoard, None
+        """
+        if not getattr(self.args, 'symmetryKeys', False):
+            return canonicalBoard, None
+        return self.game.getCanonicalSymmetry(canonicalBoard)
+
+    def simulationBudget(self, timeBudget=None, numSims=None):
+        """
+        A numSims given replaces args.numMCTSSims and disables the time budget.
+
+        Returns:
+            numSims: the maximum number of simulations for a search
+            minSims: the number of simulations to run even past the deadline
+            timeBudget: the time budget in seconds, None for a fixed number of
+                        simulations
+        """
+        if numSims is not None:
+            return numSims, numSims, None
+        if timeBudget is None:
+            timeBudget = getattr(self.args, 'timeBudget', None)
+        if timeBudget is None:
+            return self.args.numMCTSSims, self.args.numMCTSSims, None
+
+        numSims = getattr(self.args, 'maxMCTSSims', None) or sys.maxsize
+        minSims = min(getattr(self.args, 'minMCTSSims', 1), numSims)
+        return numSims, minSims, timeBudget
 
-    def search(self, canonicalBoard):
+    def actionProb(self, canonicalBoard, temp=1):
         """
-        This function performs one iteration of MCTS. It is recursively called
-        till a leaf node is found. The action chosen at each node is one that
-        has the maximum upper confidence bound as in the paper.
+        Returns:
+            probs: a policy vector where the probability of the ith action is
+                   proportional to Nsa[(s,a)]**(1./temp), from the statistics
+                   already gathered for canonicalBoard
+        """
+        s = self.game.hashState(canonicalBoard)
+        node = self.nodes[s]
+        counts = node.counts(self.game.getActionSize())
+        if node.provenEdges is not None:
+            if node.proven == 1:
+                # play one of the proven winning actions
+                counts = np.zeros_like(counts)
+                counts[node.actions[node.provenEdges == -1]] = 1
+            elif node.proven == 0:
+                # do not play the proven losing actions
+                losing = node.actions[node.provenEdges == 1]
+                if counts.sum() > counts[losing].sum():
+                    counts[losing] = 0
+        return probsFromCounts(counts, temp)
+
+    def search(self, canonicalBoard, s=None):
+        """
+        This function performs one iteration of MCTS. It descends from
+        canonicalBoard till a leaf node is found. The action chosen at each
+        node is one that has the maximum upper confidence bound as in the paper.
 
         Once a leaf node is found, the neural network is called to return an
         initial policy P and a value v for the state. This value is propagated
@@ -64,6 +508,10 @@ class MCTS():
         outcome is propagated up the search path. The values of Ns, Nsa, Qsa are
         updated.
 
+        The descent and the backup walk an explicit path instead of recursing
+        once per ply, so deep lines neither pay for a Python frame per ply nor
+        run into the interpreter's recursion limit.
+
         NOTE: the return values are the negative of the value of the current
         state. This is done since v is in [-1,1] and if v is the value of a
         state for the current player, then its value is -v for the other player.
@@ -71,66 +519,586 @@ class MCTS():
         Returns:
             v: the negative of the value of the current canonicalBoard
         """
+        path, board, s, v = self.descend(canonicalBoard, s)
+        if v == 0:
+            # leaf node
+            node, v = self.expand(board)
+            self.storeNode(s, node)
+
+        return -self.backup(path, v)
+
+    def searchSteps(self, canonicalBoard, numSims, deadline=None, minSims=0, earlyStop=False):
+        """
+        This function performs numSims iterations of MCTS starting from
+        canonicalBoard, or fewer if the time.time() deadline passes once minSims
+        iterations have been performed. With earlyStop it also stops as soon as
+        the most visited root action can no longer be caught up by another one
+        within the remaining iterations. It is a generator: instead of calling
+        the neural network it yields the list of leaf boards to evaluate and
+        expects the (pis, vs) of nnet.predictBatch for them to be sent back.
 
-        s = self.game.stringRepresentation(canonicalBoard)
+        With args.mctsBatchSize > 1 up to that many descents are made before
+        their leaves are evaluated together. Every edge on the path of a
+        descent then gets a virtual loss of args.virtualLoss (default 1) until
+        the value of its leaf is backed up, so that the descents of one batch
+        spread over different leaves. A batch is cut short when a descent
+        reaches a leaf that is already waiting for its evaluation.
 
-        if s not in self.Es:
-            self.Es[s] = self.game.getGameEnded(canonicalBoard, 1)
-        if self.Es[s] != 0:
-            # terminal node
-            return -self.Es[s]
+        With args.mctsSolver, boards proven won or lost are propagated up the
+        tree (see backup) and the search stops once the root is proven.
 
-        if s not in self.Ps:
-            # leaf node
-            self.Ps[s], v = self.nnet.predict(canonicalBoard)
-            valids = self.game.getValidMoves(canonicalBoard, 1)
-            self.Ps[s] = self.Ps[s] * valids  # masking invalid moves
-            sum_Ps_s = np.sum(self.Ps[s])
-            if sum_Ps_s > 0:
-                self.Ps[s] /= sum_Ps_s  # renormalize
-            else:
-                # if all valid moves were masked make all valid moves equally probable
-
-                # NB! All valid moves may be masked if either your NNet architecture is insufficient or you've get overfitting or something else.
-                # If you have got dozens or hundreds of these messages you should pay attention to your NNet and/or training process.   
-                log.error("All valid moves were masked, doing a workaround.")
-                self.Ps[s] = self.Ps[s] + valids
-                self.Ps[s] /= np.sum(self.Ps[s])
-
-            self.Vs[s] = valids
-            self.Ns[s] = 0
-            return -v
-
-        valids = self.Vs[s]
-        cur_best = -float('inf')
-        best_act = -1
-
-        # pick the action with the highest upper confidence bound
-        for a in range(self.game.getActionSize()):
-            if valids[a]:
-                if (s, a) in self.Qsa:
-                    u = self.Qsa[(s, a)] + self.args.cpuct * self.Ps[s][a] * math.sqrt(self.Ns[s]) / (
-                            1 + self.Nsa[(s, a)])
+        Returns:
+            sims: the number of iterations performed
+        """
+        batchSize = getattr(self.args, 'mctsBatchSize', 1)
+        virtualLoss = getattr(self.args, 'virtualLoss', 1.) if batchSize > 1 else None
+        solver = getattr(self.args, 'mctsSolver', False)
+        root = self.game.hashState(canonicalBoard)
+        sims = 0
+        while sims < numSims and (deadline is None or sims < minSims or time.time() < deadline):
+            if earlyStop and self.isDecided(root, numSims - sims):
+                break
+            if solver and root in self.nodes and self.nodes[root].proven != 0:
+                break
+            pending = {}  # leaf s -> (leaf board, search path)
+            for _ in range(min(batchSize, numSims - sims)):
+                path, board, s, ended = self.descend(canonicalBoard, root, virtualLoss)
+                if self.stats is not None:
+                    self.stats.addDescent(len(path))
+                if ended != 0:
+                    self.backup(path, ended, virtualLoss, self.nodes[s].proven if solver else 0)
+                elif s in pending:
+                    self.backup(path, None, virtualLoss)
+                    break
                 else:
-                    u = self.args.cpuct * self.Ps[s][a] * math.sqrt(self.Ns[s] + EPS)  # Q = 0 ?
+                    pending[s] = (board, path)
+                sims += 1
+
+            if pending:
+                pis, vs = yield from self.evaluateSteps([(s, board) for s, (board, _) in pending.items()])
+                for (s, (board, path)), pi, v in zip(pending.items(), pis, vs):
+                    self.storeNode(s, self.makeNode(board, pi, v))
+                    self.backup(path, v, virtualLoss)
+            self.enforceBudget(root)
+        return sims
+
+    def gumbelSteps(self, canonicalBoard, numSims, temp=1, deadline=None, minSims=0):
+        """
+        Root search by sequential halving with Gumbel noise (Danihelka et al.,
+        "Policy improvement by planning with Gumbel", 2022), a generator like
+        searchSteps. It improves on the prior even with a handful of
+        simulations, where PUCT at the root mostly follows the prior.
+
+        The args.gumbelActions (default 16) actions with the highest
+        g + logits are sampled, g being Gumbel noise (no noise with temp=0, so
+        that evaluation games are deterministic). The simulations are then
+        split into log2(gumbelActions) phases; every phase visits each
+        remaining action equally often and keeps the better half of them
+        according to g + logits + sigma(Q), see gumbelScores. Below the root
+        the usual PUCT selection is used. With a time budget the phases are
+        planned for minSims simulations and any further ones go to the
+        actions left at the end.
+
+        Returns:
+            sims: the number of iterations performed
+            probs: a one-hot policy vector for the selected action if temp is
+                   0, otherwise the improved policy softmax(logits + sigma(Q))
+                   with the Q values of the unvisited actions completed (see
+                   MCTSNode.completedQ), to be used as the training target
+        """
+        root = self.game.hashState(canonicalBoard)
+        sims = 0
+        if self.lookupNode(root) is None:
+            sims += yield from self.searchSteps(canonicalBoard, 1)
+        node = self.nodes[root]
+
+        logits = np.log(node.P + EPS)
+        g = np.random.gumbel(size=len(node.actions)) if temp != 0 else np.zeros(len(node.actions))
+        m = min(getattr(self.args, 'gumbelActions', 16), len(node.actions))
+        candidates = np.argsort(-(g + logits), kind='stable')[:m]
+        phases = max(1, math.ceil(math.log2(m)))
+        budget = numSims if deadline is None else minSims
+        solver = getattr(self.args, 'mctsSolver', False)
+
+        def running():
+            if solver and node.proven != 0:
+                return False
+            return sims < numSims and (deadline is None or sims < minSims or time.time() < deadline)
+
+        while running():
+            visits = max(1, budget // (phases * len(candidates)))
+            for _ in range(visits):
+                if not running():
+                    break
+                # one descent per remaining action, evaluated together
+                pending = {}  # leaf s -> (leaf board, search path)
+                for i in candidates[:numSims - sims]:
+                    path, board, s, ended = self.descend(canonicalBoard, root, rootIndex=i)
+                    if self.stats is not None:
+                        self.stats.addDescent(len(path))
+                    if ended != 0:
+                        self.backup(path, ended, proven=self.nodes[s].proven if solver else 0)
+                    elif s in pending:
+                        # another action of the batch reached the same leaf: not a simulation
+                        self.backup(path, None)
+                        continue
+                    else:
+                        pending[s] = (board, path)
+                    sims += 1
+                if pending:
+                    pis, vs = yield from self.evaluateSteps([(s, board) for s, (board, _) in pending.items()])
+                    for (s, (board, path)), pi, v in zip(pending.items(), pis, vs):
+                        self.storeNode(s, self.makeNode(board, pi, v))
+                        self.backup(path, v)
+                self.enforceBudget(root)
+            if len(candidates) > 1:
+                scores = self.gumbelScores(node, g + logits)[candidates]
+                candidates = candidates[np.argsort(-scores, kind='stable')[:math.ceil(len(candidates) / 2)]]
+
+        if node.proven != 0:
+            return sims, self.actionProb(canonicalBoard, temp)
+
+        probs = np.zeros(self.game.getActionSize())
+        if temp == 0:
+            scores = self.gumbelScores(node, g + logits)
+            probs[node.actions[candidates[np.argmax(scores[candidates])]]] = 1
+        else:
+            scores = self.gumbelScores(node, logits) / temp
+            scores = np.exp(scores - np.max(scores))
+            probs[node.actions] = scores / np.sum(scores)
+        return sims, probs.tolist()
 
-                if u > cur_best:
-                    cur_best = u
-                    best_act = a
+    def gumbelScores(self, node, logits):
+        """
+        Returns logits + sigma(completed Q) for the actions of the node, where
+        sigma(q) = (args.gumbelCVisit + max N) * args.gumbelCScale * q with q
+        rescaled from [-1,1] to [0,1]. Actions proven to lose score -inf.
+        """
+        cVisit = getattr(self.args, 'gumbelCVisit', 50)
+        cScale = getattr(self.args, 'gumbelCScale', 1.)
+        q = (node.completedQ() + 1) / 2
+        scores = logits + (cVisit + np.max(node.N)) * cScale * q
+        if node.provenEdges is not None:
+            scores[node.provenEdges == 1] = -np.inf
+        return scores
+
+    def evaluateSteps(self, leaves):
+        """
+        Evaluates the (s, board) leaves, a generator like searchSteps. Leaves
+        found in the shared evaluation cache (args.evalCacheSize > 0, see
+        EvalCache) are not yielded; the others are, and their evaluations are
+        added to the cache.
+
+        Returns:
+            pis: the policy of each leaf
+            vs: the value of each leaf
+        """
+        if self.evalCache is None and self.stats is None:
+            return (yield [board for _, board in leaves])
+
+        results = [None] * len(leaves)
+        if self.evalCache is not None:
+            version = self.nnet.modelVersion()
+            results = [self.evalCache.get(version, s) for s, _ in leaves]
+        misses = [k for k, result in enumerate(results) if result is None]
+        if misses:
+            start = time.perf_counter()
+            pis, vs = yield [leaves[k][1] for k in misses]
+            if self.stats is not None:
+                self.stats.evaluateTime += time.perf_counter() - start
+            for k, pi, v in zip(misses, pis, vs):
+                if self.evalCache is not None:
+                    self.evalCache.put(version, leaves[k][0], pi, v)
+                results[k] = (pi, v)
+        if self.stats is not None:
+            self.stats.expanded += len(leaves)
+            self.stats.cacheHits += len(leaves) - len(misses)
+        return [pi for pi, _ in results], [v for _, v in results]
+
+    def isDecided(self, s, remainingSims):
+        """
+        Returns True if the most visited action at board s stays the only most
+        visited one whatever the next remainingSims simulations do.
+        """
+        node = self.nodes.get(s)
+        if node is None or node.actions is None or node.Ns == 0:
+            return False
+        if len(node.actions) == 1:
+            return True
+        second, best = np.partition(node.N, -2)[-2:]
+        return best - second > remainingSims
+
+    def descend(self, canonicalBoard, s=None, virtualLoss=None, rootIndex=None):
+        """
+        Walks down from canonicalBoard along the actions with the highest upper
+        confidence bound until it reaches a terminal state or a board without a
+        node. Unless virtualLoss is None, a virtual loss is added to every edge
+        taken. Unless rootIndex is None, the first action taken is
+        node.actions[rootIndex] instead. With args.symmetryKeys every board reached
+        is replaced by its representative symmetrical form.
+
+        If the game implements Game.applyInPlace (and args.symmetryKeys is not
+        set), the moves are applied to canonicalBoard itself and undone before
+        returning, so that only the board of a leaf to evaluate is copied.
 
-        a = best_act
-        next_s, next_player = self.game.getNextState(canonicalBoard, 1, a)
-        next_s = self.game.getCanonicalForm(next_s, next_player)
+        Games whose keys can repeat within a line (Tafl keys, for instance, do
+        not count the moves played) make the tree a cyclic graph. A descent
+        that comes back to a board already on its path stops there and scores
+        it as a draw (REPETITION), so that it always ends.
 
-        v = self.search(next_s)
+        Returns:
+            path: the list of (node, index of the action taken) from the root
+            board: the board that was reached, None if ended is not 0 and the
+                   moves were applied in place
+            s: the key of board, see Game.hashState
+            ended: game.getGameEnded for board, or its proven value for a
+                   proven board, 0 for a leaf to evaluate
+        """
+        path = []
+        onPath = set()  # keys of the boards of path
+        undos = [] if self.inPlace else None
+        board = canonicalBoard
+        while True:
+            if s is None:
+                s = self.game.hashState(board)
+            if path:
+                parent, i = path[-1]
+                parent.children[i] = s
+            if s in onPath:
+                ended = REPETITION
+                break
+            onPath.add(s)
+            node = self.lookupNode(s)
+            if node is None:
+                ended = self.game.getGameEnded(board, 1)
+                if ended != 0:
+                    self.storeNode(s, MCTSNode(ended=ended))
+                break
+            if node.ended != 0:
+                ended = node.ended
+                break
+            if node.proven != 0:
+                # the subtree of a proven node is never searched again
+                ended = node.proven
+                break
+
+            # pick the action with the highest upper confidence bound
+            if rootIndex is not None and not path:
+                i = rootIndex
+            elif virtualLoss is None:
+                i = node.selectAction(self.args.cpuct)
+            else:
+                i = node.selectAction(self.args.cpuct, virtualLoss)
+            if virtualLoss is not None:
+                node.addVirtualLoss(i)
+            path.append((node, i))
+            if undos is None:
+                next_s, next_player = self.game.getNextState(board, 1, node.actions[i])
+                board, _ = self.canonicalSymmetry(self.game.getCanonicalForm(next_s, next_player))
+            else:
+                undos.append(self.game.applyInPlace(board, node.actions[i]))
+            s = None
+
+        if undos:
+            # the leaf must outlive the undo
+            leaf = copyBoard(board) if ended == 0 else None
+            for undoInfo in reversed(undos):
+                self.game.undo(board, undoInfo)
+            board = leaf
+        return path, board, s, ended
+
+    def backup(self, path, v, virtualLoss=None, proven=0):
+        """
+        Propagates the value v of the board reached by a descent up its path,
+        negating it at every level, and removes the virtual loss of the
+        descent unless virtualLoss is None. If v is None the descent is
+        abandoned and only its virtual loss is removed.
+
+        If the board reached is proven won or lost (proven = 1 or -1) the proof
+        is propagated up the path as far as it goes, see MCTSNode.markProven.
+
+        Returns:
+            v: the value backed up through the first edge of the path, from the
+               point of view of the player to move at its start
+        """
+        for node, i in reversed(path):
+            if virtualLoss is not None:
+                node.removeVirtualLoss(i)
+            if v is not None:
+                v = -v
+                node.update(i, v)
+                if proven != 0:
+                    proven = node.markProven(i, proven)
+        return v
+
+    def advanceRoot(self, canonicalBoard):
+        """
+        Makes canonicalBoard the root of the search tree: the nodes that can be
+        reached from it through the edges explored so far are kept, together
+        with their statistics, and every other node is discarded. Call it with
+        the board reached after the chosen action (or after the opponent's
+        reply) to carry the statistics of that subtree over to the next search
+        while freeing the sibling subtrees.
+
+        Returns:
+            inherited: the number of simulations already run through
+                       canonicalBoard, 0 if it was not in the tree
+        """
+        s = self.game.hashState(canonicalBoard)
+        root = self.nodes.get(s)
+        if root is None:
+            self.clearTree()
+            return 0
+
+        reachable = set()
+        stack = [s]
+        while stack:
+            s = stack.pop()
+            node = self.nodes.get(s)
+            if node is None or s in reachable:
+                continue
+            reachable.add(s)
+            if node.children:
+                stack.extend(node.children.values())
+        self.nodes = OrderedDict((s, node) for s, node in self.nodes.items() if s in reachable)
+        self.nodesBytes = sum(sys.getsizeof(s) + node.nbytes() for s, node in self.nodes.items())
+        return root.Ns
+
+    def clearTree(self):
+        """
+        Discards every node of the search tree.
+        """
+        self.nodes = OrderedDict()
+        self.nodesBytes = 0
+
+    def closeRootWorkers(self):
+        """
+        Stops the root-parallel worker processes, if any. They are started
+        again, with the current weights of nnet, by the next root-parallel
+        search.
+        """
+        if self.rootWorkers is not None:
+            self.rootWorkers.close()
+            self.rootWorkers = None
+
+    def lookupNode(self, s):
+        """
+        Returns the node of board s, or None if s has no node, counting the
+        lookup as a hit or a miss and marking the node as recently used.
+        """
+        node = self.nodes.get(s)
+        if node is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.nodes.move_to_end(s)
+        return node
+
+    def storeNode(self, s, node):
+        self.nodes[s] = node
+        self.nodesBytes += sys.getsizeof(s) + node.nbytes()
+
+    def enforceBudget(self, root):
+        """
+        Evicts nodes once the tree holds more than args.mctsMaxNodes nodes or
+        more than args.mctsMaxBytes (estimated) bytes. Nodes are evicted down
+        to 90% of the budget, either least recently used first
+        (args.mctsEviction = 'lru', the default) or least visited first
+        ('visits'). The root and the nodes on a descent that is waiting for
+        its leaf value are never evicted. Statistics of the edges leading to an
+        evicted node are kept; the node is evaluated again when it is reached.
+        """
+        maxNodes = getattr(self.args, 'mctsMaxNodes', None)
+        maxBytes = getattr(self.args, 'mctsMaxBytes', None)
+        overNodes = maxNodes is not None and len(self.nodes) > maxNodes
+        overBytes = maxBytes is not None and self.nodesBytes > maxBytes
+        if not (overNodes or overBytes):
+            return
+
+        targetNodes = int(0.9 * maxNodes) if maxNodes is not None else len(self.nodes)
+        targetBytes = int(0.9 * maxBytes) if maxBytes is not None else self.nodesBytes
+        candidates = ((s, node) for s, node in self.nodes.items() if s != root and not node.pending)
+        if getattr(self.args, 'mctsEviction', 'lru') == 'visits':
+            candidates = sorted(candidates, key=lambda item: item[1].Ns)
+        else:
+            candidates = list(candidates)
+
+        for s, node in candidates:
+            if len(self.nodes) <= targetNodes and self.nodesBytes <= targetBytes:
+                break
+            del self.nodes[s]
+            self.nodesBytes -= sys.getsizeof(s) + node.nbytes()
+            self.evictions += 1
+
+    def tableStats(self):
+        """
+        Returns the size of the tree and the lookup and eviction counters, to
+        help sizing args.mctsMaxNodes and args.mctsMaxBytes.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'nodes': len(self.nodes),
+            'bytes': self.nodesBytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / lookups if lookups else 0.,
+            'evictions': self.evictions,
+        }
+
+    def expand(self, canonicalBoard):
+        """
+        Evaluates a non-terminal leaf with the neural network and builds its
+        node.
+
+        Returns:
+            node: the new MCTSNode for canonicalBoard
+            v: the value of canonicalBoard predicted by the neural network
+        """
+        pi, v = self.nnet.predict(canonicalBoard)
+        return self.makeNode(canonicalBoard, pi, v), v
+
+    def makeNode(self, canonicalBoard, pi, v=0.):
+        """
+        Builds the node of canonicalBoard from the policy pi returned by the
+        neural network, keeping the masked and renormalized prior over valid
+        actions only.
+        """
+        actions = np.asarray(self.game.getValidActions(canonicalBoard, 1), dtype=np.int64)
+        P = np.asarray(pi, dtype=np.float64)[actions]  # masking invalid moves
+        sum_Ps_s = np.sum(P)
+        if sum_Ps_s > 0:
+            P /= sum_Ps_s  # renormalize
+        else:
+            # if all valid moves were masked make all valid moves equally probable
+
+            # NB! All valid moves may be masked if either your NNet architecture is insufficient or you've get overfitting or something else.
+            # If you have got dozens or hundreds of these messages you should pay attention to your NNet and/or training process.
+            log.error("All valid moves were masked, doing a workaround.")
+            P = np.full(len(actions), 1. / len(actions))
+
+        return MCTSNode(actions=actions, P=P, V=float(v))
+
+
+class RootParallelWorkers():
+    """
+    Worker processes for root-parallel search, used by MCTS.getActionProb when
+    args.rootParallelWorkers > 1. Each worker loads its own copy of the neural
+    network and keeps its own search tree; the simulations of a move are split
+    between the workers and their root visit counts are summed. The workers
+    stay alive between moves, so the processes are started and the model is
+    loaded only once.
+
+    The network is handed to the workers through a temporary checkpoint, so
+    the workers keep the weights nnet had when they were started: call
+    MCTS.closeRootWorkers after changing them, and once the MCTS is no
+    longer used, since the workers otherwise live until the process exits.
+    """
+
+    def __init__(self, game, nnet, args):
+        self.folder = tempfile.mkdtemp(prefix='root_parallel_')
+        filename = 'root_parallel.pth.tar'
+        nnet.save_checkpoint(folder=self.folder, filename=filename)
+
+        context = spawnContext()
+        seed = np.random.randint(2 ** 31 - 1 - args.rootParallelWorkers)
+        self.connections = []
+        self.processes = []
+        for k in range(args.rootParallelWorkers):
+            connection, workerConnection = context.Pipe()
+            process = context.Process(target=rootParallelWorker, daemon=True,
+                                      args=(workerConnection, game, nnet.__class__, self.folder, filename, args,
+                                            seed + k))
+            process.start()
+            self.connections.append(connection)
+            self.processes.append(process)
+        atexit.register(self.close)
+
+    def counts(self, canonicalBoard, numSims, minSims=None, timeBudget=None):
+        """
+        Runs numSims simulations from canonicalBoard split over the workers,
+        or, with a timeBudget, as many as the workers run within it, but at
+        least minSims of them.
+
+        Returns:
+            counts: the root visit counts summed over the workers
+            sims: the number of simulations run by all workers
+        """
+        workers = len(self.connections)
+        minSims = numSims if minSims is None else minSims
+        for k, connection in enumerate(self.connections):
+            connection.send((canonicalBoard, numSims // workers + (k < numSims % workers),
+                             minSims // workers + (k < minSims % workers), timeBudget))
+        results = [connection.recv() for connection in self.connections]
+        return sum(counts for counts, _ in results), sum(sims for _, sims in results)
+
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass  # the worker already exited
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+        shutil.rmtree(self.folder, ignore_errors=True)
+        atexit.unregister(self.close)
+
+
+def rootParallelWorker(connection, game, nnetClass, folder, filename, args, seed):
+    """
+    Main loop of a root-parallel worker process. The worker receives
+    (canonicalBoard, numSims, minSims, timeBudget) and answers with the visit
+    counts of its own tree at canonicalBoard and the number of simulations it
+    ran, until it receives None.
+
+    The trees of the workers differ by Dirichlet noise mixed into the prior
+    of each root (args.rootDirichletAlpha, default 0.3, with weight
+    args.rootDirichletWeight, default 0.25) under a seed per worker.
+    Otherwise every worker would run the same deterministic search. The
+    noise only lasts for the search: the prior of the root is restored
+    afterwards, so that a position searched again gets fresh noise.
+
+    A worker outlives the games it searches, so its tree is bounded: with
+    args.reuseSubtree only the subtree of the current position is kept
+    between moves (see MCTS.advanceRoot), otherwise every search starts
+    from an empty tree.
+    """
+    np.random.seed(seed)
+    nnet = nnetClass(game)
+    nnet.load_checkpoint(folder=folder, filename=filename)
+    mcts = MCTS(game, nnet, args)
+    alpha = getattr(args, 'rootDirichletAlpha', 0.3)
+    weight = getattr(args, 'rootDirichletWeight', 0.25)
 
-        if (s, a) in self.Qsa:
-            self.Qsa[(s, a)] = (self.Nsa[(s, a)] * self.Qsa[(s, a)] + v) / (self.Nsa[(s, a)] + 1)
-            self.Nsa[(s, a)] += 1
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        canonicalBoard, numSims, minSims, timeBudget = message
+        deadline = time.time() + timeBudget if timeBudget is not None else None
+        sims = 0
 
+        if getattr(args, 'reuseSubtree', False):
+            mcts.advanceRoot(canonicalBoard)
         else:
-            self.Qsa[(s, a)] = v
-            self.Nsa[(s, a)] = 1
+            mcts.clearTree()
+        s = game.hashState(canonicalBoard)
+        if s not in mcts.nodes and numSims > 0:
+            # expand the root before adding noise to its prior
+            sims += runSteps(mcts.searchSteps(canonicalBoard, 1), nnet)
+        root = mcts.nodes.get(s)
+        prior = None
+        if root is not None and root.actions is not None:
+            noise = np.random.dirichlet([alpha] * len(root.actions))
+            prior = root.P
+            root.P = (1 - weight) * prior + weight * noise
+        sims += runSteps(mcts.searchSteps(canonicalBoard, numSims - sims, deadline, minSims - sims), nnet)
+        if prior is not None:
+            root.P = prior
 
-        self.Ns[s] += 1
-        return -v
+        root = mcts.nodes.get(s)
+        counts = np.zeros(game.getActionSize(), dtype=np.int64)
+        if root is not None and root.actions is not None:
+            counts = root.counts(game.getActionSize())
+        connection.send((counts, sims))
@@ -1,3 +1,23 @@
+import functools
+import itertools
+
+_versions = itertools.count()  # source of model versions, unique within the process
+
+
+def _newVersionAfter(method):
+    """
+    Wraps a method that changes the weights so that the network gets a new
+    model version once it returns.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._modelVersion = next(_versions)
+    return wrapper
+
+
 class NeuralNet():
     """
     This class specifies the base NeuralNet class. To define your own neural
@@ -5,12 +25,33 @@ class NeuralNet():
     network does not consider the current player, and instead only deals with
     the canonical form of the board.
 
+    The train and load_checkpoint methods of subclasses are wrapped so that
+    every call gives the network a new modelVersion.
+
     See othello/NNet.py for an example implementation.
     """
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name in ('train', 'load_checkpoint'):
+            if name in cls.__dict__:
+                setattr(cls, name, _newVersionAfter(cls.__dict__[name]))
+
     def __init__(self, game):
         pass
 
+    def modelVersion(self):
+        """
+        Returns:
+            version: an int identifying the current weights of this network.
+                     It is unique within the process and changes whenever
+                     train or load_checkpoint is called, so it can key cached
+                     predictions (see EvalCache).
+        """
+        if '_modelVersion' not in self.__dict__:
+            self._modelVersion = next(_versions)
+        return self._modelVersion
+
     def train(self, examples):
         """
         This function trains the neural network with examples obtained from
@@ -36,6 +77,21 @@ class NeuralNet():
         """
         pass
 
+    def predictBatch(self, boards):
+        """
+        Input:
+            boards: a list of boards in their canonical form.
+
+        Returns:
+            pis: a list with the policy vector of each board
+            vs: a list with the value of each board
+
+        The default implementation calls predict once per board. Override it
+        to evaluate all boards in a single forward pass.
+        """
+        predictions = [self.predict(board) for board in boards]
+        return [pi for pi, _ in predictions], [v for _, v in predictions]
+
     def save_checkpoint(self, folder, filename):
         """
         Saves the current neural network (with its parameters) in
@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class ReplayBuffer():
+    """
+    Training examples (board, pi, v) stored column by column in memory-mapped
+    numpy files under folder, in a ring of capacity examples: once it is full
+    every new example replaces the oldest one. The files are reopened as they
+    are when a ReplayBuffer is created on an existing folder, so nothing has
+    to be loaded after a restart.
+
+    Boards must be numpy arrays or tuples of them; every array gets a column
+    of its own, with its dtype and shape. Other parts of a tuple board, like
+    the draw_counter dict of Animal Shogi boards, are not kept: they come back
+    as empty dicts, since the networks do not read them.
+
+    A ReplayBuffer can be passed to NeuralNet.train in place of the list of
+    examples: len and indexing give the examples, and sample gives whole
+    random batches as arrays, read straight from the columns without building
+    a tuple per example. arrays gives all the examples at once, for the
+    wrappers that fit on the whole set.
+    """
+
+    def __init__(self, folder, capacity):
+        self.folder = folder
+        self.capacity = capacity
+        self.layout = None  # None for array boards, else the kind ('array' or 'dict') of each element of the boards
+        self.columns = None  # name -> memory-mapped array of capacity rows
+        self.total = 0  # examples ever added
+        metaFile = os.path.join(folder, 'meta.json')
+        if os.path.exists(metaFile):
+            with open(metaFile) as f:
+                meta = json.load(f)
+            if meta['capacity'] != capacity:
+                log.warning(f"Replay buffer {folder} keeps its capacity of {meta['capacity']} examples")
+            self.capacity = meta['capacity']
+            self.layout = meta['layout']
+            self.total = meta['total']
+            self.columns = {name: np.lib.format.open_memmap(os.path.join(folder, name + '.npy'), mode='r+')
+                            for name in meta['columns']}
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def __getitem__(self, i):
+        """
+        Returns:
+            example: the (board, pi, v) of the ith example, counting from the
+                     oldest one kept
+        """
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        row = (self.total - len(self) + i) % self.capacity
+        return self.board(row), np.array(self.columns['pi'][row]), float(self.columns['v'][row])
+
+    def board(self, rows):
+        """
+        Returns:
+            board: the board at rows (an int, or an array of rows to get the
+                   boards stacked along a first axis)
+        """
+        if self.layout is None:
+            return np.array(self.columns['board'][rows])
+        return tuple(np.array(self.columns[f'board{k}'][rows]) if kind == 'array' else {}
+                     for k, kind in enumerate(self.layout))
+
+    def extend(self, examples):
+        """
+        Appends examples, a sequence of (board, pi, v), creating the files
+        from the first example if the buffer is new.
+        """
+        if not examples:
+            return
+        if self.columns is None:
+            self.create(examples[0])
+        n = len(examples)
+        if n > self.capacity:
+            examples = examples[n - self.capacity:]
+            self.total += n - self.capacity
+            n = self.capacity
+        rows = (self.total + np.arange(n)) % self.capacity
+        boards, pis, vs = zip(*examples)
+        if self.layout is None:
+            self.columns['board'][rows] = np.array(boards)
+        else:
+            for k, kind in enumerate(self.layout):
+                if kind == 'array':
+                    self.columns[f'board{k}'][rows] = np.array([board[k] for board in boards])
+        self.columns['pi'][rows] = np.array(pis)
+        self.columns['v'][rows] = np.array(vs)
+        self.total += n
+        self.flush()
+
+    def sample(self, batchSize):
+        """
+        Returns:
+            boards, pis, vs: batchSize examples drawn uniformly at random (with
+                             replacement), as arrays stacked along a first
+                             axis (a tuple of them for tuple boards)
+        """
+        rows = (self.total - len(self) + np.random.randint(len(self), size=batchSize)) % self.capacity
+        return self.board(rows), np.array(self.columns['pi'][rows]), np.array(self.columns['v'][rows])
+
+    def arrays(self):
+        """
+        Returns:
+            boards, pis, vs: all the examples kept, oldest first, as arrays
+                             stacked along a first axis like sample
+        """
+        rows = (self.total - len(self) + np.arange(len(self))) % self.capacity
+        return self.board(rows), np.array(self.columns['pi'][rows]), np.array(self.columns['v'][rows])
+
+    def create(self, example):
+        board, pi, _ = example
+        if isinstance(board, np.ndarray):
+            arrays = {'board': board}
+        elif isinstance(board, tuple):
+            self.layout = ['array' if isinstance(part, np.ndarray) else 'dict' for part in board]
+            arrays = {f'board{k}': part for k, part in enumerate(board) if isinstance(part, np.ndarray)}
+        else:
+            raise TypeError(f'Cannot store boards of type {type(board).__name__} in a replay buffer')
+        arrays['pi'] = np.asarray(pi, dtype=np.float32)
+        arrays['v'] = np.zeros((), dtype=np.float32)
+
+        os.makedirs(self.folder, exist_ok=True)
+        self.columns = {name: np.lib.format.open_memmap(os.path.join(self.folder, name + '.npy'), mode='w+',
+                                                        dtype=array.dtype, shape=(self.capacity,) + array.shape)
+                        for name, array in arrays.items()}
+
+    def flush(self):
+        """
+        Writes the columns to disk, then the number of examples, so that a
+        buffer reopened after a crash never reads rows that were not written.
+        """
+        for column in self.columns.values():
+            column.flush()
+        meta = {'capacity': self.capacity, 'layout': self.layout, 'total': self.total,
+                'columns': list(self.columns)}
+        metaFile = os.path.join(self.folder, 'meta.json')
+        with open(metaFile + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(metaFile + '.tmp', metaFile)
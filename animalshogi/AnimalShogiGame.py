@@ -5,6 +5,65 @@ from Game import Game
 from .AnimalShogiLogic import Board
 import numpy as np
 
+# Zobrist keys: a random 64-bit integer per (cell, piece), per (side, motigoma,
+# count) and per value of the move counter. The hash of a board is the xor of
+# the keys of its contents.
+_rng = np.random.RandomState(20180108)
+ZOBRIST_PIECES = _rng.randint(0, 2**63, size=(12, 11), dtype=np.int64).tolist()  # [x * 4 + y][piece + 5]
+ZOBRIST_MOTI = _rng.randint(0, 2**63, size=(2, 4, 3), dtype=np.int64).tolist()  # [side][piece][count]
+ZOBRIST_COUNTER = _rng.randint(0, 2**63, size=1024, dtype=np.int64).tolist()  # [draw_counter[0] % 1024]
+# draw_counter entry holding the Zobrist hashes of (pieces, moti), from the
+# point of view of the board and of its canonical form for the opponent
+ZOBRIST = 'zobrist'
+
+
+def zobristHash(pieces, moti):
+    """
+    Returns the Zobrist hashes of (pieces, moti) as given and as returned by
+    getCanonicalForm for the other player (rotated and inverted).
+    """
+    h = hFlip = 0
+    for cell, piece in enumerate(pieces.ravel().tolist()):
+        if piece:
+            h ^= ZOBRIST_PIECES[cell][piece + 5]
+            hFlip ^= ZOBRIST_PIECES[11 - cell][5 - piece]
+    for side in range(2):
+        for piece in range(1, 4):
+            count = moti[side][piece]
+            if count:
+                h ^= ZOBRIST_MOTI[side][piece][count]
+                hFlip ^= ZOBRIST_MOTI[1 - side][piece][count]
+    return h, hFlip
+
+
+def zobristMove(hashes, move, side, piecesBefore, motiBefore, pieces, moti):
+    """
+    Returns the Zobrist hashes (see zobristHash) after move was played by
+    side (0 for player 1, 1 for player -1), from the hashes before it. Only the
+    source and destination cells and the motigomas of side can change:
+    piecesBefore gives the pieces before the move on these cells (an array or
+    a dict keyed by (x, y)) and motiBefore the motigomas of side.
+    """
+    h, hFlip = hashes
+    src_x, src_y, dst_x, dst_y = move
+    captured = src_x == 3 or piecesBefore[dst_x, dst_y]
+    cells = [(dst_x, dst_y)] if src_x == 3 else [(src_x, src_y), (dst_x, dst_y)]
+    for x, y in cells:
+        cell = 4 * x + y
+        for piece in (piecesBefore[x, y], pieces.item(x, y)):
+            if piece:
+                h ^= ZOBRIST_PIECES[cell][piece + 5]
+                hFlip ^= ZOBRIST_PIECES[11 - cell][5 - piece]
+    for piece in range(1, 4) if captured else ():
+        before, after = motiBefore[piece], moti.item(side, piece)
+        if before != after:
+            for count in (before, after):
+                if count:
+                    h ^= ZOBRIST_MOTI[side][piece][count]
+                    hFlip ^= ZOBRIST_MOTI[1 - side][piece][count]
+    return h, hFlip
+
+
 class AnimalShogiGame(Game):
     square_content = {
         -5: "[L]",
@@ -26,11 +85,14 @@ class AnimalShogiGame(Game):
 
     def __init__(self, turn_limit):
         self.turn_limit = turn_limit
+        self._base_board = Board(turn_limit)  # applyInPlace plays on it, swapping in the arrays of the board
 
     def getInitBoard(self):
         # return initial board (numpy board)
         b = Board(self.turn_limit)
-        return np.array(b.pieces), np.array(b.moti), b.draw_counter
+        pieces, moti = np.array(b.pieces), np.array(b.moti)
+        b.draw_counter[ZOBRIST] = zobristHash(pieces, moti)
+        return pieces, moti, b.draw_counter
 
     def getBoardSize(self):
         # (a,b) tuple
@@ -59,8 +121,63 @@ class AnimalShogiGame(Game):
             
         #print('getNextState', action, move)
         b.execute_move(move, player)
+
+        # update the Zobrist hashes with the source and destination cells and
+        # the motigomas of the player, the only contents a move changes
+        hashes = draw_counter[ZOBRIST] if ZOBRIST in draw_counter else zobristHash(pieces, moti)
+        side = 0 if player == 1 else 1
+        b.draw_counter[ZOBRIST] = zobristMove(hashes, move, side, pieces, moti[side].tolist(), b.pieces, b.moti)
         return ((b.pieces, b.moti, b.draw_counter), -player)
 
+    def applyInPlace(self, board, action):
+        # play for player 1 and switch sides, without copying the board
+        pieces, moti, draw_counter = board
+        b = self._base_board
+        b.pieces, b.moti, b.draw_counter = pieces, moti, draw_counter
+        move = (int(action / 48), int(action / 12) % 4, int(action / 4) % 3, action % 4)
+        src_x, src_y, dst_x, dst_y = move
+
+        before = ({(src_x, src_y): pieces.item(src_x, src_y)} if src_x != 3 else {})
+        before[(dst_x, dst_y)] = pieces.item(dst_x, dst_y)
+        motiBefore = moti[0].tolist()
+        hashes = draw_counter.get(ZOBRIST)
+        counterBefore = draw_counter[0]
+        entries = len(draw_counter)
+        b.execute_move(move, 1)
+
+        # the position entry counting repetitions, if the move updated one
+        repetition = None
+        if src_x != 3:
+            repetition = (next(reversed(draw_counter)), True) if len(draw_counter) > entries else (b._hash(1), False)
+        draw_counter[ZOBRIST] = zobristMove(hashes or zobristHash(pieces, moti), move, 0, before, motiBefore, pieces, moti)
+
+        # canonical form for the opponent
+        pieces[:] = -pieces[::-1, ::-1]
+        moti[:] = moti[::-1]
+        h, hFlip = draw_counter[ZOBRIST]
+        draw_counter[ZOBRIST] = (hFlip, h)
+        return before, motiBefore, hashes, counterBefore, repetition
+
+    def undo(self, board, undoInfo):
+        pieces, moti, draw_counter = board
+        before, motiBefore, hashes, counterBefore, repetition = undoInfo
+        pieces[:] = -pieces[::-1, ::-1]
+        moti[:] = moti[::-1]
+        for (x, y), piece in before.items():
+            pieces[x][y] = piece
+        moti[0] = motiBefore
+        draw_counter[0] = counterBefore
+        if hashes is None:
+            del draw_counter[ZOBRIST]
+        else:
+            draw_counter[ZOBRIST] = hashes
+        if repetition is not None:
+            key, added = repetition
+            if added:
+                del draw_counter[key]
+            else:
+                draw_counter[key] -= 1
+
     def getValidMoves(self, board, player):
         # return a fixed size binary vector
         pieces, moti, _ = board
@@ -114,7 +231,11 @@ class AnimalShogiGame(Game):
         # return state if player==1, else return -state if player==-1
         if player == -1:
             pieces, moti, draw_counter = board
-            return np.flip(-pieces, (0, 1)), moti[::-1], draw_counter.copy()
+            draw_counter = draw_counter.copy()
+            if ZOBRIST in draw_counter:
+                h, hFlip = draw_counter[ZOBRIST]
+                draw_counter[ZOBRIST] = (hFlip, h)
+            return np.flip(-pieces, (0, 1)), moti[::-1], draw_counter
         else:
             return board
 
@@ -128,7 +249,9 @@ class AnimalShogiGame(Game):
         pi_board_uti = np.reshape(pi[144:], (3, 3, 4))
         new_pi = np.hstack((np.flip(pi_board, (1, 3)).ravel(), np.flip(pi_board_uti, (2)).ravel()))
 
-        l = [((pieces, moti, draw_counter.copy()), pi), ((np.fliplr(pieces), moti, draw_counter.copy()), new_pi)]
+        mirrored_draw_counter = draw_counter.copy()
+        mirrored_draw_counter.pop(ZOBRIST, None)  # the hashes are those of the unmirrored board
+        l = [((pieces, moti, draw_counter.copy()), pi), ((np.fliplr(pieces), moti, mirrored_draw_counter), new_pi)]
 
         return l
 
@@ -136,6 +259,12 @@ class AnimalShogiGame(Game):
         pieces, moti, draw_counter = board
         return pieces.tostring() + moti.tostring() + bytes('%02d' % draw_counter[0], 'utf-8')
 
+    def hashState(self, board):
+        # Zobrist hash of the same contents as stringRepresentation
+        pieces, moti, draw_counter = board
+        h, _ = draw_counter[ZOBRIST] if ZOBRIST in draw_counter else zobristHash(pieces, moti)
+        return h ^ ZOBRIST_COUNTER[draw_counter[0] % 1024]
+
     def stringRepresentationReadable(self, board):  # TODO: print motigoma
         pieces, moti, draw_counter = board
         pieces_s = "".join(self.square_content[square] for row in pieces for square in row)
@@ -8,6 +8,7 @@ from tqdm import tqdm
 sys.path.append('../../')
 from utils import *
 from NeuralNet import NeuralNet
+from ReplayBuffer import ReplayBuffer
 
 import torch
 import torch.optim as optim
@@ -45,7 +46,8 @@ class NNetWrapper(NeuralNet):
 
     def train(self, examples):
         """
-        examples: list of examples, each example is of form (board, pi, v)
+        examples: list of examples, each example is of form (board, pi, v),
+                  or a ReplayBuffer
         """
         optimizer = optim.Adam(self.nnet.parameters())
 
@@ -59,10 +61,14 @@ class NNetWrapper(NeuralNet):
 
             t = tqdm(range(batch_count), desc='Training Net')
             for _ in t:
-                sample_ids = np.random.randint(len(examples), size=args.batch_size)
-                boards, pis, vs = list(zip(*[examples[i] for i in sample_ids]))
-                # Get rid of draw_counter's
-                boards, motis, _ = zip(*boards)
+                if isinstance(examples, ReplayBuffer):
+                    # the buffer stacks the boards and leaves out the draw_counter's
+                    (boards, motis, _), pis, vs = examples.sample(args.batch_size)
+                else:
+                    sample_ids = np.random.randint(len(examples), size=args.batch_size)
+                    boards, pis, vs = list(zip(*[examples[i] for i in sample_ids]))
+                    # Get rid of draw_counter's
+                    boards, motis, _ = zip(*boards)
                 boards = torch.FloatTensor(np.array(boards).astype(np.float64))
                 motis = torch.FloatTensor(np.array(motis)[:, :, 1:].astype(np.float64))
                 target_pis = torch.FloatTensor(np.array(pis))
@@ -111,6 +117,22 @@ class NNetWrapper(NeuralNet):
         # print('PREDICTION TIME TAKEN : {0:03f}'.format(time.time()-start))
         return torch.exp(pi).data.cpu().numpy()[0], v.data.cpu().numpy()[0]
 
+    def predictBatch(self, boards):
+        """
+        boards: list of (np array with board, moti, draw_counter)
+        """
+        boards, motis, _ = zip(*boards)
+        boards = torch.FloatTensor(np.array(boards).astype(np.float64))
+        motis = torch.FloatTensor(np.array(motis)[:, :, 1:].astype(np.float64))
+        if args.cuda:
+            boards = boards.contiguous().cuda()
+            motis = motis.contiguous().cuda()
+        self.nnet.eval()
+        with torch.no_grad():
+            pis, vs = self.nnet(boards, motis)
+
+        return torch.exp(pis).data.cpu().numpy(), vs.data.cpu().numpy()[:, 0]
+
     def loss_pi(self, targets, outputs):
         return -torch.sum(targets * outputs) / targets.size()[0]
 
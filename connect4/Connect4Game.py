@@ -30,6 +30,17 @@ class Connect4Game(Game):
         b.add_stone(action, player)
         return b.np_pieces, -player
 
+    def applyInPlace(self, board, action):
+        """Plays for player 1 and switches sides, modifying board instead of copying it."""
+        row = self._base_board.with_np_pieces(np_pieces=board).add_stone(action, 1)
+        np.negative(board, out=board)
+        return row, action
+
+    def undo(self, board, undoInfo):
+        row, action = undoInfo
+        np.negative(board, out=board)
+        board[row][action] = 0
+
     def getValidMoves(self, board, player):
         "Any zero value in top row in a valid move"
         return self._base_board.with_np_pieces(np_pieces=board).get_valid_moves()
@@ -32,6 +32,7 @@ class Board():
             raise ValueError("Can't play column %s on board %s" % (column, self))
 
         self.np_pieces[available_idx[-1]][column] = player
+        return available_idx[-1]
 
     def get_valid_moves(self):
         "Any zero value in top row in a valid move"
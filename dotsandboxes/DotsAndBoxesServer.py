@@ -25,7 +25,9 @@ def predict():
 
     use_alpha_zero = True
     if use_alpha_zero:
-        action = np.argmax(mcts.getActionProb(board, temp=0))
+        probs, sims = mcts.getActionProbTimed(board, temp=0)
+        app.logger.debug('%d simulations', sims)
+        action = np.argmax(probs)
     else:
         action = GreedyRandomPlayer(g).play(board)
 
@@ -39,6 +41,8 @@ def predict():
 if __name__ == '__main__':
     g = DotsAndBoxesGame(n=3)
     n1 = NNetWrapper(g)
-    mcts = MCTS(g, n1, dotdict({'numMCTSSims': 50, 'cpuct': 1.0}))
+    # answer within timeBudget seconds, running between minMCTSSims and maxMCTSSims simulations
+    mcts = MCTS(g, n1, dotdict({'numMCTSSims': 50, 'cpuct': 1.0, 'rootParallelWorkers': 1,
+                                'timeBudget': 0.5, 'minMCTSSims': 10, 'maxMCTSSims': 400}))
     n1.load_checkpoint(os.path.join('..', 'pretrained_models', 'dotsandboxes', 'keras', '3x3'), 'best.pth.tar')
     app.run(debug=False, host='0.0.0.0', port=8888)
@@ -4,6 +4,7 @@ import os
 sys.path.append('..')
 from utils import dotdict
 from NeuralNet import NeuralNet
+from ReplayBuffer import ReplayBuffer
 
 from .DotsAndBoxesNNet import DotsAndBoxesNNet as onnet
 
@@ -42,9 +43,13 @@ class NNetWrapper(NeuralNet):
 
     def train(self, examples):
         """
-        examples: list of examples, each example is of form (board, pi, v)
+        examples: list of examples, each example is of form (board, pi, v),
+                  or a ReplayBuffer
         """
-        input_boards, target_pis, target_vs = list(zip(*examples))
+        if isinstance(examples, ReplayBuffer):
+            input_boards, target_pis, target_vs = examples.arrays()
+        else:
+            input_boards, target_pis, target_vs = list(zip(*examples))
         input_boards = np.asarray(input_boards)
 
         normalize_score(input_boards)
@@ -1,7 +1,7 @@
 from __future__ import print_function
 import sys
 sys.path.append('..')
-from Game import Game
+from Game import Game, squareBoardSymmetry
 from .GobangLogic import Board
 import numpy as np
 
@@ -35,6 +35,18 @@ class GobangGame(Game):
         b.execute_move(move, player)
         return (b.pieces, -player)
 
+    def applyInPlace(self, board, action):
+        # play for player 1 and switch sides, without copying the board
+        if action != self.n * self.n:
+            board[int(action / self.n)][action % self.n] = 1
+        np.negative(board, out=board)
+        return action
+
+    def undo(self, board, action):
+        np.negative(board, out=board)
+        if action != self.n * self.n:
+            board[int(action / self.n)][action % self.n] = 0
+
     # modified
     def getValidMoves(self, board, player):
         # return a fixed size binary vector
@@ -96,6 +108,9 @@ class GobangGame(Game):
                 l += [(newB, list(newPi.ravel()) + [pi[-1]])]
         return l
 
+    def getCanonicalSymmetry(self, board):
+        return squareBoardSymmetry(board, self.n)
+
     def stringRepresentation(self, board):
         # 8x8 numpy array (canonical board)
         return board.tostring()
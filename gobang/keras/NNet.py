@@ -10,6 +10,7 @@ import tensorflow as tf
 sys.path.append('..')
 from utils import *
 from NeuralNet import NeuralNet
+from ReplayBuffer import ReplayBuffer
 
 import argparse
 from .GobangNNet import GobangNNet as onnet
@@ -34,9 +35,13 @@ class NNetWrapper(NeuralNet):
 
     def train(self, examples):
         """
-        examples: list of examples, each example is of form (board, pi, v)
+        examples: list of examples, each example is of form (board, pi, v),
+                  or a ReplayBuffer
         """
-        input_boards, target_pis, target_vs = list(zip(*examples))
+        if isinstance(examples, ReplayBuffer):
+            input_boards, target_pis, target_vs = examples.arrays()
+        else:
+            input_boards, target_pis, target_vs = list(zip(*examples))
         input_boards = np.asarray(input_boards)
         target_pis = np.asarray(target_pis)
         target_vs = np.asarray(target_vs)
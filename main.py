@@ -23,13 +23,50 @@ args = dotdict({
     'updateThreshold': 0.6,     # During arena playoff, new neural net will be accepted if threshold or more of games are won.
     'maxlenOfQueue': 200000,    # Number of game examples to train the neural networks.
     'numMCTSSims': 25,          # Number of games moves for MCTS to simulate.
+    'fullSearchProb': 1,        # Fraction of self-play moves searched with numMCTSSims and kept as training examples.
+    'fastMCTSSims': 5,          # Simulations of the other self-play moves, which are played but not trained on.
+    'resignThreshold': None,    # Self-play resigns when the root value stays below this (None to never resign).
+    'resignMoves': 3,           # Number of consecutive searches of a player below the threshold to resign.
+    'resignCheckFraction': 0.1, # Fraction of self-play games played to the end to measure wrong resignations.
+    'resignFalsePositives': 0.05,  # Fraction of wrong resignations the threshold is tuned to stay under.
+    'mctsSolver': False,        # Propagate proven wins and losses and stop searching proven positions.
+    'earlyStop': False,         # Stop temp=0 searches once the most visited move cannot be overtaken.
+    'timeBudget': None,         # Seconds of search per move instead of numMCTSSims (None to use numMCTSSims).
     'arenaCompare': 40,         # Number of games to play during arena play to determine if new net will be accepted.
+    'arenaWorkers': 1,          # Number of processes playing the arena games in parallel.
+    'arenaSprt': False,         # Stop the arena games once a sequential probability ratio test settles the decision.
+    'sprtAlpha': 0.05,          # Probability of accepting a network winning updateThreshold - sprtMargin of the games.
+    'sprtBeta': 0.05,           # Probability of rejecting a network winning updateThreshold + sprtMargin of the games.
+    'sprtMargin': 0.1,          # Half width of the indifference zone of the test around updateThreshold.
     'cpuct': 1,
+    'selfPlayWorkers': 1,       # Number of processes playing self-play games in parallel (up to the number of cores).
+    'inferenceServer': False,   # Evaluate the boards of all self-play workers in one process holding the network.
+    'inferenceMaxBatch': 256,   # Largest batch of boards the inference server evaluates at once.
+    'inferenceMaxWait': 0.002,  # Seconds the inference server waits for more boards before evaluating a batch.
+    'asyncPipeline': False,     # Overlap self-play, training and arena evaluation (uses the selfPlayWorkers processes).
+    'trainRoundsPerCheckpoint': 1,  # With asyncPipeline, calls of nnet.train between two evaluated checkpoints.
+    'gamesPerTrainRound': None, # With asyncPipeline, new self-play games needed before each call of nnet.train (None for numEps).
+    'lockstepGames': 1,         # Number of self-play games advanced together, sharing batched network calls.
+    'mctsBatchSize': 1,         # Number of MCTS descents whose leaves are evaluated in one batched forward pass.
+    'virtualLoss': 1,           # Value counted as lost for every edge on a descent waiting for its leaf evaluation.
+    'reuseSubtree': False,      # Keep only the subtree of the current position between moves.
+    'mctsMaxNodes': None,       # Evict MCTS nodes when the tree holds more nodes than this (None for no limit).
+    'mctsMaxBytes': None,       # Evict MCTS nodes when the tree holds more (estimated) bytes than this (None for no limit).
+    'mctsEviction': 'lru',      # Evict the least recently used ('lru') or the least visited ('visits') nodes first.
+    'evalCacheSize': 0,         # Number of network evaluations cached across all searches (0 to disable).
+    'symmetryKeys': False,      # Share MCTS nodes between symmetrical positions (games with getCanonicalSymmetry).
+    'collectStats': False,      # Record per-search statistics (sims, depth, time split) and log them per iteration.
+    'statsFile': None,          # With collectStats, also append the statistics of every search to this JSONL file.
+    'inPlaceDescent': False,    # Walk down the MCTS tree by applying and undoing moves (games with applyInPlace).
+    'gumbelRoot': False,        # Pick root actions by Gumbel sequential halving instead of PUCT (for small numMCTSSims).
+    'gumbelActions': 16,        # Number of root actions sampled for sequential halving.
 
     'checkpoint': './ashogickpt/',
     'load_model': True,
     'load_folder_file': ('./ashogickpt','best.pth.tar'),
     'numItersForTrainExamplesHistory': 20,
+    'replayBuffer': False,      # Keep the examples in memory-mapped files under checkpoint/replay instead of pickling them.
+    'replayBufferSize': 1000000,  # Number of examples the replay buffer keeps, the oldest being replaced first.
     'cuda': True,
 
 })
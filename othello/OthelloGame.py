@@ -1,7 +1,7 @@
 from __future__ import print_function
 import sys
 sys.path.append('..')
-from Game import Game
+from Game import Game, squareBoardSymmetry
 from .OthelloLogic import Board
 import numpy as np
 
@@ -18,6 +18,7 @@ class OthelloGame(Game):
 
     def __init__(self, n):
         self.n = n
+        self._base_board = Board(n)  # applyInPlace plays on it, swapping in the pieces of the board
 
     def getInitBoard(self):
         # return initial board (numpy board)
@@ -43,6 +44,24 @@ class OthelloGame(Game):
         b.execute_move(move, player)
         return (b.pieces, -player)
 
+    def applyInPlace(self, board, action):
+        # play for player 1 and switch sides, without copying the board
+        flips = []
+        if action != self.n*self.n:
+            b = self._base_board
+            b.pieces = board
+            flips = b.execute_move((int(action/self.n), action%self.n), 1)
+        np.negative(board, out=board)
+        return flips
+
+    def undo(self, board, flips):
+        np.negative(board, out=board)
+        for x, y in flips:
+            board[x][y] = -1
+        if flips:
+            x, y = flips[0]  # the square played
+            board[x][y] = 0
+
     def getValidMoves(self, board, player):
         # return a fixed size binary vector
         valids = [0]*self.getActionSize()
@@ -89,6 +108,9 @@ class OthelloGame(Game):
                 l += [(newB, list(newPi.ravel()) + [pi[-1]])]
         return l
 
+    def getCanonicalSymmetry(self, board):
+        return squareBoardSymmetry(board, self.n)
+
     def stringRepresentation(self, board):
         return board.tostring()
 
@@ -112,6 +112,7 @@ class Board():
         for x, y in flips:
             #print(self[x][y],color)
             self[x][y] = color
+        return flips
 
     def _discover_move(self, origin, direction):
         """ Returns the endpoint for a legal move, starting at the given origin,
@@ -12,29 +12,32 @@ use this script to play any two agents against each other, or play manually with
 any agent.
 """
 
-g = AnimalShogiGame()
+# root-parallel players start worker processes, which re-import this module
+if __name__ == "__main__":
+    g = AnimalShogiGame()
 
-# all players
-rp = RandomPlayer(g).play
-gp = GreedyAnimalShogiPlayer(g).play
-hp = HumanAnimalShogiPlayer(g).play
+    # all players
+    rp = RandomPlayer(g).play
+    gp = GreedyAnimalShogiPlayer(g).play
+    hp = HumanAnimalShogiPlayer(g).play
 
 
 
-# nnet players
+    # nnet players
 
-n1 = NNet(g)
-n1.load_checkpoint('./ashogickpt/','best.pth.tar')
-args1 = dotdict({'numMCTSSims': 50, 'cpuct':1.0})
-mcts1 = MCTS(g, n1, args1)
-n1p = lambda x: np.argmax(mcts1.getActionProb(x, temp=0))
+    n1 = NNet(g)
+    n1.load_checkpoint('./ashogickpt/','best.pth.tar')
+    # set the same 'timeBudget' (seconds per move) for both players to compare them at equal time
+    args1 = dotdict({'numMCTSSims': 50, 'cpuct':1.0, 'reuseSubtree': True, 'rootParallelWorkers': 1, 'timeBudget': None})
+    mcts1 = MCTS(g, n1, args1)
+    n1p = lambda x: np.argmax(mcts1.getActionProb(x, temp=0))
 
-n2 = NNet(g)
-n2.load_checkpoint('./ashogickpt/','best.pth.tar')
-args2 = dotdict({'numMCTSSims': 50, 'cpuct': 1.0})
-mcts2 = MCTS(g, n2, args2)
-n2p = lambda x: np.argmax(mcts2.getActionProb(x, temp=0))
-    
-arena = Arena.Arena(n1p, n2p, g, display=AnimalShogiGame.display)
+    n2 = NNet(g)
+    n2.load_checkpoint('./ashogickpt/','best.pth.tar')
+    args2 = dotdict({'numMCTSSims': 50, 'cpuct': 1.0, 'reuseSubtree': True, 'rootParallelWorkers': 1, 'timeBudget': None})
+    mcts2 = MCTS(g, n2, args2)
+    n2p = lambda x: np.argmax(mcts2.getActionProb(x, temp=0))
 
-print(arena.playGames(100, verbose=True))
+    arena = Arena.Arena(n1p, n2p, g, display=AnimalShogiGame.display)
+
+    print(arena.playGames(100, verbose=True))
@@ -5,6 +5,7 @@ import numpy as np
 
 sys.path.append('../..')
 from NeuralNet import NeuralNet
+from ReplayBuffer import ReplayBuffer
 from rts.keras.RTSNNet import RTSNNet
 from rts.src.config import VERBOSE_MODEL_FIT
 
@@ -39,11 +40,14 @@ class NNetWrapper(NeuralNet):
     def train(self, examples):
         """
         Encodes examples using one of 2 encoders and starts fitting.
-        :param examples: list of examples, each example is of form (board, pi, v)
+        :param examples: list of examples, each example is of form (board, pi, v), or a ReplayBuffer
         """
         from rts.src.config_class import CONFIG
 
-        input_boards, target_pis, target_vs = list(zip(*examples))
+        if isinstance(examples, ReplayBuffer):
+            input_boards, target_pis, target_vs = examples.arrays()
+        else:
+            input_boards, target_pis, target_vs = list(zip(*examples))
         input_boards = np.asarray(input_boards)
         target_pis = np.asarray(target_pis)
         target_vs = np.asarray(target_vs)
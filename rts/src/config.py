@@ -426,8 +426,8 @@ class Configuration:
             self.player2_model_file = player2_model_file
             self.player1_onehot_encoder = player1_onehot_encoder
             self.player2_onehot_encoder = player2_onehot_encoder
-            self.player1_config = player1_config or {'numMCTSSims': 2, 'cpuct': 1.0}
-            self.player2_config = player2_config or {'numMCTSSims': 2, 'cpuct': 1.0}
+            self.player1_config = player1_config or {'numMCTSSims': 2, 'cpuct': 1.0, 'gumbelRoot': True}
+            self.player2_config = player2_config or {'numMCTSSims': 2, 'cpuct': 1.0, 'gumbelRoot': True}
             self.num_games = num_games
 
         def create_players(self,
@@ -472,7 +472,7 @@ class Configuration:
                     encoder = NumericEncoder()
                 n1 = NNet(g, encoder)
                 n1.load_checkpoint('.\\..\\temp\\', player_model_file)
-                args1 = dotdict(player_config or {'numMCTSSims': 2, 'cpuct': 1.0})
+                args1 = dotdict(player_config or {'numMCTSSims': 2, 'cpuct': 1.0, 'gumbelRoot': True})
                 mcts1 = MCTS(g, n1, args1)
                 self.play = lambda x: np.argmax(mcts1.getActionProb(x, temp=0))
 
@@ -484,6 +484,7 @@ class Configuration:
                      update_threshold,
                      maxlen_of_queue,
                      num_mcts_sims,
+                     gumbel_root,
                      arena_compare,
                      cpuct,
                      checkpoint,
@@ -498,6 +499,7 @@ class Configuration:
             self.updateThreshold = update_threshold  # Percentage that new model has to surpass by win rate to replace old model
             self.maxlenOfQueue = maxlen_of_queue
             self.numMCTSSims = num_mcts_sims  # How many MCTS tree searches are performing (mind that this MCTS doesnt use simulations)
+            self.gumbelRoot = gumbel_root  # Select root actions by Gumbel sequential halving, which still improves on the policy with few sims
             self.arenaCompare = arena_compare  # How many comparisons are made between old and new model
             self.cpuct = cpuct  # search parameter for MCTS
 
@@ -567,6 +569,7 @@ class Configuration:
                  update_threshold: float = 0.6,
                  maxlen_of_queue: int = 6400,
                  num_mcts_sims: int = 10,
+                 gumbel_root: bool = True,
                  arena_compare: int = 10,
                  cpuct: float = 1,
                  checkpoint: str = '.\\..\\temp\\',
@@ -709,6 +712,7 @@ class Configuration:
         :param update_threshold: Percentage of how much wins should newer model have to be accepted
         :param maxlen_of_queue: How many train examples can be stored in each iteration
         :param num_mcts_sims: How many MCTS sims are executed in each game episode while learning
+        :param gumbel_root: If root actions are selected by Gumbel sequential halving instead of PUCT, which still improves on the network policy with very few sims
         :param arena_compare: How many comparations of newer and older model should be made before evaluating which is better
         :param cpuct: Exploration parameter for MCTS
         :param checkpoint: folder where checkpoints should be saved while learning
@@ -794,6 +798,7 @@ class Configuration:
             update_threshold=update_threshold,
             maxlen_of_queue=maxlen_of_queue,
             num_mcts_sims=num_mcts_sims,
+            gumbel_root=gumbel_root,
             arena_compare=arena_compare,
             cpuct=cpuct,
             checkpoint=checkpoint,
@@ -49,7 +49,7 @@ class TD2020LearnAPI(TFPluginAPI):
                 self.g = RTSGame()
                 n1 = NNet(self.g, OneHotEncoder())
                 n1.load_checkpoint(current_directory, 'best.pth.tar')
-                args = dotdict({'numMCTSSims': 2, 'cpuct': 1.0})
+                args = dotdict({'numMCTSSims': 2, 'cpuct': 1.0, 'gumbelRoot': True})
                 self.mcts = MCTS(self.g, n1, args)
 
                 self.graph_var = graph
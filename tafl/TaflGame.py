@@ -43,16 +43,19 @@ class TaflGame(Game):
 
     def getValidMoves(self, board, player):
         # return a fixed size binary vector
-        #Note: Ignoreing the passed in player variable since we are not inverting colors for getCanonicalForm and Arena calls with constant 1.
         valids = [0]*self.getActionSize()
+        for action in self.getValidActions(board, player):
+            valids[action]=1
+        return np.array(valids)
+
+    def getValidActions(self, board, player):
+        # return the indices of the valid moves, without the n**4 long vector
+        #Note: Ignoreing the passed in player variable since we are not inverting colors for getCanonicalForm and Arena calls with constant 1.
         b = board.getCopy()
         legalMoves =  b.get_legal_moves(board.getPlayerToMove())
         if len(legalMoves)==0:
-            valids[-1]=1
-            return np.array(valids)
-        for x1, y1, x2, y2 in legalMoves:
-            valids[x1+y1*self.n+x2*self.n**2+y2*self.n**3]=1
-        return np.array(valids)
+            return np.array([self.getActionSize()-1])
+        return np.unique([x1+y1*self.n+x2*self.n**2+y2*self.n**3 for x1, y1, x2, y2 in legalMoves])
 
     def getGameEnded(self, board, player):
         # return 0 if not ended, if player 1 won, -1 if player 1 lost
@@ -84,6 +87,10 @@ class TaflGame(Game):
         #print("->",str(board))
         return str(board)
 
+    def hashState(self, board):
+        # Zobrist hash maintained by Board._moveByPieceNo
+        return board.zobrist
+
     def getScore(self, board, player):
         if board.done: return 1000*board.done*player
         return board.countDiff(player)
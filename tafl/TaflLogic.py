@@ -1,6 +1,13 @@
 import numpy as np
 from .GameVariants import Tafl
 
+# Zobrist keys: a random 64-bit integer per (cell, piece type) for boards of
+# up to 19x19 and one for black to move. The hash of a board is the xor of the
+# keys of its pieces.
+_rng = np.random.RandomState(20190517)
+ZOBRIST_PIECES = _rng.randint(0, 2**63, size=(19 * 19, 4), dtype=np.int64).tolist()  # [y * size + x][type + 1]
+ZOBRIST_BLACK = int(_rng.randint(0, 2**63, dtype=np.int64))
+
 class Board():
 
 
@@ -12,6 +19,7 @@ class Board():
       self.pieces=gv.pieces #[x,y,type]
       self.time=0
       self.done=0
+      self.zobrist=self._zobristHash()
 
     def __str__(self):
         return str(self.getPlayerToMove()) + ''.join(str(r) for v in self.getImage() for r in v) 
@@ -31,6 +39,7 @@ class Board():
       b = Board(gv)
       b.time=self.time
       b.done=self.done
+      b.zobrist=self.zobrist
       return b
 
 
@@ -140,11 +149,14 @@ class Board():
       self.time = self.time + 1
 
       piece=self.pieces[pieceno]
+      self.zobrist ^= self._zobristKey(piece) ^ ZOBRIST_BLACK
       piece[0]=x2
       piece[1]=y2
+      self.zobrist ^= self._zobristKey(piece)
       caps = self._getCaptures(pieceno,x2,y2)
       #print("Captures = ",caps)
       for c in caps:
+          self.zobrist ^= self._zobristKey(c)
           c[0]=-99
 
       self.done = self._getWinLose()
@@ -153,6 +165,16 @@ class Board():
         
 
 
+    def _zobristKey(self,piece):
+       return ZOBRIST_PIECES[piece[1]*self.size+piece[0]][piece[2]+1]
+
+    def _zobristHash(self):
+       # same contents as str(self): the pieces on the board and the player to move
+       h = ZOBRIST_BLACK if self.getPlayerToMove() == -1 else 0
+       for piece in self.pieces:
+           if piece[0] >= 0: h ^= self._zobristKey(piece)
+       return h
+
     def _getWinLose(self):
        if self.time > 50: return -1
        for apiece in self.pieces:
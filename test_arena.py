@@ -0,0 +1,67 @@
+"""
+Unit tests for Arena.py, playing TicTacToe with a small deterministic stand-in
+for the neural network.
+
+To run tests:
+python -m unittest test_arena
+"""
+
+import unittest
+
+import numpy as np
+
+from Arena import Arena, MCTSPlayerFactory
+from test_helpers import UniformNNet
+from tictactoe.TicTacToeGame import TicTacToeGame
+from utils import *
+
+
+class FirstMovePlayerFactory():
+    """Builds a player that always plays its first valid move."""
+
+    def __init__(self, game):
+        self.game = game
+
+    def __call__(self):
+        return lambda board: int(np.flatnonzero(self.game.getValidMoves(board, 1))[0]), None
+
+
+class TestArena(unittest.TestCase):
+
+    def test_parallel_arena(self):
+        game = TicTacToeGame()
+        args = dotdict({'numMCTSSims': 25, 'cpuct': 1.0, 'collectStats': True})
+        factories = (MCTSPlayerFactory(game, UniformNNet, 'folder', 'filename', args), FirstMovePlayerFactory(game))
+        (player1, mcts), (player2, _) = [factory() for factory in factories]
+        arena = Arena(player1, player2, game, searches=(mcts, None), factories=factories)
+        oneWon, twoWon, draws = arena.playGames(6, workers=2)
+        self.assertEqual(6, oneWon + twoWon + draws)
+        # the search statistics come back from the workers
+        stats = arena.searchStats[0]
+        self.assertGreaterEqual(stats['searches'], 6)
+        self.assertEqual(25 * stats['searches'], stats['simulations'])
+        self.assertEqual(0, arena.searchStats[1]['searches'])
+
+        # the same players in this process
+        oneWon, twoWon, draws = arena.playGames(2)
+        self.assertEqual(2, oneWon + twoWon + draws)
+        self.assertGreaterEqual(arena.searchStats[0]['searches'], 2)
+        self.assertEqual(0, arena.searchStats[1]['searches'])
+
+    def test_sprt_arena(self):
+        game = TicTacToeGame()
+        args = dotdict({'numMCTSSims': 25, 'cpuct': 1.0})
+        mctsFactory = MCTSPlayerFactory(game, UniformNNet, 'folder', 'filename', args)
+        (mctsPlayer, _), (firstMovePlayer, _) = mctsFactory(), FirstMovePlayerFactory(game)()
+        # the search beats always playing the first valid move
+        for players, decision in [((firstMovePlayer, mctsPlayer), 'accept'), ((mctsPlayer, firstMovePlayer), 'reject')]:
+            arena = Arena(*players, game)
+            oneWon, twoWon, draws = arena.playGamesSPRT(40, 0.6)
+            self.assertEqual(decision, arena.sprt['decision'])
+            self.assertLess(arena.sprt['games'], 40)
+            self.assertEqual(arena.sprt['games'], oneWon + twoWon + draws)
+            self.assertGreater(arena.sprt['confidence'], 0.95)
+
+
+if __name__ == '__main__':
+    unittest.main()
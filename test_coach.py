@@ -0,0 +1,121 @@
+"""
+Unit tests for Coach.py, playing TicTacToe with a small deterministic stand-in
+for the neural network.
+
+To run tests:
+python -m unittest test_coach
+"""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from Coach import Coach
+from MCTS import runSteps
+from test_helpers import SearchTestCase, UniformNNet
+from tictactoe.TicTacToeGame import TicTacToeGame
+from utils import *
+
+
+class CrashingNNet(UniformNNet):
+    """Kills the process loading it for the first time in a folder."""
+
+    def load_checkpoint(self, folder, filename):
+        marker = os.path.join(folder, 'crashed')
+        if not os.path.exists(marker):
+            open(marker, 'w').close()
+            os._exit(1)
+
+
+class TestCoach(SearchTestCase):
+
+    def test_playout_cap_randomization(self):
+        game, mcts = self.make_mcts(tempThreshold=15, fastMCTSSims=5)
+        runSteps(mcts.getActionProbSteps(game.getInitBoard(), temp=1, numSims=5), mcts.nnet)
+        self.assertEqual(5, mcts.searchStats['simulations'])
+
+        # only the moves searched with numMCTSSims give training examples
+        coach = Coach(game, mcts.nnet, mcts.args)
+        self.assertGreater(len(coach.executeEpisode()), 0)
+        mcts.args.fullSearchProb = 0
+        self.assertEqual([], coach.executeEpisode())
+
+    def test_resignation(self):
+        game, mcts = self.make_mcts(tempThreshold=15, resignThreshold=0.5, resignMoves=2, resignCheckFraction=0)
+        coach = Coach(game, mcts.nnet, mcts.args)
+        # with a value of about 0 everywhere player 1 resigns at its second move
+        examples = coach.executeEpisode()
+        self.assertEqual(1, coach.resignedGames)
+        self.assertEqual(3 * 8, len(examples))
+        self.assertEqual([-1] * 8 + [1] * 8 + [-1] * 8, [v for _, _, v in examples])
+
+        # games played to the end give the thresholds at which resigning is wrong
+        coach.resignChecks.extend([-0.9] + [-0.5] * 18 + [np.inf])
+        self.assertEqual(19 / 20, coach.calibrateResignation())
+        self.assertEqual(-0.5, coach.resignThreshold)
+
+    def test_lockstep_self_play(self):
+        game = TicTacToeGame()
+        nnet = UniformNNet(game)
+        batchSizes = []
+        predictBatch = nnet.predictBatch
+        nnet.predictBatch = lambda boards: batchSizes.append(len(boards)) or predictBatch(boards)
+        args = dotdict({'numMCTSSims': 10, 'cpuct': 1.0, 'tempThreshold': 15, 'lockstepGames': 3})
+        coach = Coach(game, nnet, args)
+        finished = []
+        episodeSteps = coach.episodeSteps
+
+        def countedSteps(mcts):
+            examples = yield from episodeSteps(mcts)
+            finished.append(len(examples))
+            return examples
+
+        coach.episodeSteps = countedSteps
+        examples = coach.executeEpisodesLockstep(7)
+        self.assertEqual(7, len(finished))
+        self.assertEqual(sum(finished), len(examples))
+        # the games in progress share their network calls
+        self.assertEqual(3, max(batchSizes))
+        for board, pi, v in examples:
+            self.assertEqual((3, 3), board.shape)
+            self.assertEqual(game.getActionSize(), len(pi))
+            self.assertAlmostEqual(1., sum(pi))
+            self.assertIn(v, [-1, 1, 1e-4, -1e-4])
+
+    def test_parallel_self_play(self):
+        game = TicTacToeGame()
+        args = dotdict({'numMCTSSims': 10, 'cpuct': 1.0, 'tempThreshold': 15, 'selfPlayWorkers': 2,
+                        'checkpoint': tempfile.mkdtemp()})
+        coach = Coach(game, CrashingNNet(game), args)
+        # the episodes are played again by new workers after the first ones died
+        examples = coach.executeEpisodesParallel(4)
+        coach.closeSelfPlayWorkers()
+        self.assertTrue(os.path.exists(os.path.join(args.checkpoint, 'crashed')))
+        self.assertGreaterEqual(len(examples), 4 * 5 * 8)
+        for board, pi, v in examples:
+            self.assertEqual((3, 3), board.shape)
+            self.assertAlmostEqual(1., sum(pi))
+            self.assertIn(v, [-1, 1, 1e-4, -1e-4])
+
+    def test_async_pipeline(self):
+        game = TicTacToeGame()
+        args = dotdict({'numMCTSSims': 5, 'cpuct': 1.0, 'tempThreshold': 15, 'selfPlayWorkers': 2, 'numEps': 2,
+                        'numIters': 2, 'arenaCompare': 2, 'updateThreshold': 0.6, 'maxlenOfQueue': 1000,
+                        'numItersForTrainExamplesHistory': 2, 'asyncPipeline': True,
+                        'checkpoint': tempfile.mkdtemp()})
+        coach = Coach(game, UniformNNet(game), args)
+        coach.learn()
+        self.assertIsNone(coach.selfPlayPool)
+        # only the checkpoints the evaluator took were saved
+        saved = sorted(f for f in os.listdir(args.checkpoint) if f.startswith('checkpoint_') and f.endswith('.pth.tar'))
+        self.assertEqual([coach.getCheckpointFile(1), coach.getCheckpointFile(2)], saved)
+        self.assertTrue(os.path.exists(os.path.join(args.checkpoint, 'best.pth.tar')))
+        self.assertFalse(os.path.exists(os.path.join(args.checkpoint, 'best.tmp.pth.tar')))
+        self.assertTrue(os.path.exists(os.path.join(args.checkpoint, coach.getCheckpointFile(0) + '.examples')))
+        self.assertGreater(sum(len(history) for history in coach.trainExamplesHistory), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
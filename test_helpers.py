@@ -0,0 +1,52 @@
+"""
+Stand-ins shared by the unit tests: a small deterministic neural network, so
+only numpy is required, and a test case searching TicTacToe with it.
+"""
+
+import os
+import unittest
+
+import numpy as np
+
+from MCTS import MCTS
+from NeuralNet import NeuralNet
+from tictactoe.TicTacToeGame import TicTacToeGame
+from utils import *
+
+
+class UniformNNet(NeuralNet):
+    """Returns a uniform policy and a value of 0 for every board."""
+
+    def __init__(self, game):
+        self.action_size = game.getActionSize()
+
+    def predict(self, board):
+        return np.ones(self.action_size) / self.action_size, 0
+
+    def save_checkpoint(self, folder, filename):
+        os.makedirs(folder, exist_ok=True)
+        open(self.get_filepath(folder, filename), 'w').close()
+
+    def get_filepath(self, folder, filename):
+        return os.path.join(folder, filename)
+
+    def load_checkpoint(self, folder, filename):
+        pass
+
+
+class SearchTestCase(unittest.TestCase):
+    """Builds TicTacToe searches and boards for the tests."""
+
+    @staticmethod
+    def make_mcts(**kwargs):
+        game = TicTacToeGame()
+        args = dotdict({'numMCTSSims': 50, 'cpuct': 1.0})
+        args.update(kwargs)
+        return game, MCTS(game, UniformNNet(game), args)
+
+    @staticmethod
+    def board_from_moves(game, moves):
+        board, player = game.getInitBoard(), 1
+        for move in moves:
+            board, player = game.getNextState(board, player, move)
+        return game.getCanonicalForm(board, player)
@@ -0,0 +1,85 @@
+"""
+Unit tests for InferenceServer.py, evaluating TicTacToe boards with a small
+deterministic stand-in for the neural network.
+
+To run tests:
+python -m unittest test_inference_server
+"""
+
+import tempfile
+import unittest
+
+import numpy as np
+
+from Coach import Coach
+from InferenceServer import InferenceServer
+from test_helpers import SearchTestCase, UniformNNet
+from tictactoe.TicTacToeGame import TicTacToeGame
+from utils import *
+
+
+class FailingNNet(UniformNNet):
+    """Fails to evaluate any board."""
+
+    def predict(self, board):
+        raise ValueError('cannot evaluate')
+
+
+class TestInferenceServer(SearchTestCase):
+
+    def test_inference_server(self):
+        game = TicTacToeGame()
+        nnet = UniformNNet(game)
+        args = dotdict({'numMCTSSims': 10, 'cpuct': 1.0, 'tempThreshold': 15, 'selfPlayWorkers': 2,
+                        'inferenceServer': True, 'inferenceMaxBatch': 4, 'inferenceSlotBoards': 4,
+                        'checkpoint': tempfile.mkdtemp()})
+        with self.assertRaisesRegex(ValueError, 'inferenceMaxBytes'):
+            InferenceServer(game, nnet, dotdict(dict(args, inferenceMaxBytes=1 << 20)))
+        server = InferenceServer(game, nnet, args)
+        try:
+            server.load(nnet)
+            client = server.client()
+            boards = [self.board_from_moves(game, moves) for moves in [[], [4], [4, 0], [4, 0, 8], [1, 2, 3]]]
+            pis, vs = client.predictBatch(boards)
+            self.assertEqual((5, game.getActionSize()), pis.shape)
+            self.assertTrue(np.allclose(1. / game.getActionSize(), pis))
+            self.assertTrue(np.all(vs == 0))
+
+            # the client changes version when the server loads new weights
+            version = client.modelVersion()
+            nnet.load_checkpoint('folder', 'filename')
+            server.load(nnet)
+            self.assertNotEqual(version, client.modelVersion())
+
+            stats = server.stats()
+            self.assertEqual(2, stats['requests'])
+            self.assertEqual(5, stats['boards'])
+            self.assertEqual(2, sum(count for _, count in stats['queueLatency']))
+            self.assertEqual([(1, 1), (2, 0), (4, 1)], stats['batchSizes'])
+        finally:
+            server.close()
+
+        # failed evaluations and a dead server fail the requests instead of hanging
+        server = InferenceServer(game, FailingNNet(game), args)
+        try:
+            client = server.client()
+            with self.assertRaisesRegex(RuntimeError, 'failed to evaluate'):
+                client.predict(game.getInitBoard())
+            self.assertEqual(0, server.stats()['batches'])
+            server.process.terminate()
+            with self.assertRaisesRegex(RuntimeError, 'died'):
+                client.predict(game.getInitBoard())
+        finally:
+            server.close()
+
+        # self-play workers evaluate their boards on the server of the coach
+        coach = Coach(game, nnet, args)
+        examples = coach.executeEpisodesParallel(4)
+        self.assertGreater(coach.inferenceServer.stats()['batches'], 0)
+        coach.closeSelfPlayWorkers()
+        coach.inferenceServer.close()
+        self.assertGreaterEqual(len(examples), 4 * 5 * 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,342 @@
+"""
+Unit tests for MCTS.py. They use TicTacToe with a small deterministic stand-in
+for the neural network, so only numpy is required.
+
+To run tests:
+python -m unittest test_mcts
+"""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+from EvalCache import sharedEvalCache
+from Game import Game
+from MCTS import MCTS, aggregateStats, runSteps
+from animalshogi.AnimalShogiGame import AnimalShogiGame
+from othello.OthelloGame import OthelloGame
+from test_helpers import SearchTestCase, UniformNNet
+from tictactoe.TicTacToeGame import TicTacToeGame
+from utils import *
+
+
+class SparseTicTacToeGame(TicTacToeGame):
+    """Lists its valid actions instead of returning a dense vector."""
+
+    def getValidActions(self, board, player):
+        return [int(a) for a in np.flatnonzero(super().getValidMoves(board, player))]
+
+    def getValidMoves(self, board, player):
+        raise AssertionError('MCTS should only ask for the valid actions')
+
+
+class CyclicGame(Game):
+    """
+    A token on a ring of 4 squares, moved one square either way; the game
+    never ends, so every line comes back to its boards.
+    """
+
+    def getInitBoard(self):
+        return np.array([0])
+
+    def getBoardSize(self):
+        return (1,)
+
+    def getActionSize(self):
+        return 2
+
+    def getNextState(self, board, player, action):
+        return np.array([(board[0] + (1 if action == 0 else -1)) % 4]), -player
+
+    def getValidMoves(self, board, player):
+        return np.ones(2)
+
+    def getGameEnded(self, board, player):
+        return 0
+
+    def getCanonicalForm(self, board, player):
+        return board
+
+    def stringRepresentation(self, board):
+        return board.tobytes()
+
+
+class TestMCTS(SearchTestCase):
+
+    def test_probs_cover_valid_moves_only(self):
+        game, mcts = self.make_mcts()
+        board = self.board_from_moves(game, [4])
+        probs = mcts.getActionProb(board, temp=1)
+        valids = game.getValidMoves(board, 1)
+        self.assertAlmostEqual(1., sum(probs))
+        self.assertTrue(all(p == 0 for p, v in zip(probs, valids) if not v))
+
+    def test_visit_counts_match_simulations(self):
+        game, mcts = self.make_mcts()
+        board = game.getInitBoard()
+        mcts.getActionProb(board, temp=1)
+        root = mcts.nodes[game.stringRepresentation(board)]
+        # the first simulation only expands the root
+        self.assertEqual(49, root.Ns)
+        self.assertEqual(49, root.N.sum())
+
+    def test_finds_winning_move(self):
+        game, mcts = self.make_mcts(numMCTSSims=100)
+        # player 1 owns (0,0) and (0,1), so playing (0,2) wins
+        board = self.board_from_moves(game, [0, 4, 1, 8])
+        probs = mcts.getActionProb(board, temp=0)
+        self.assertEqual(2, int(np.argmax(probs)))
+
+    def test_batched_search(self):
+        game, mcts = self.make_mcts(numMCTSSims=100, mctsBatchSize=8)
+        board = self.board_from_moves(game, [0, 4, 1, 8])
+        probs = mcts.getActionProb(board, temp=0)
+        self.assertEqual(2, int(np.argmax(probs)))
+        root = mcts.nodes[game.stringRepresentation(board)]
+        self.assertEqual(0, root.pending)
+        self.assertEqual(root.Ns, root.N.sum())
+        self.assertTrue(all(node.pending == 0 for node in mcts.nodes.values()))
+
+    def test_cyclic_game(self):
+        game = CyclicGame()
+        mcts = MCTS(game, UniformNNet(game), dotdict({'numMCTSSims': 100, 'cpuct': 1.0}))
+        board = game.getInitBoard()
+        for _ in range(3):
+            probs = mcts.getActionProb(board, temp=1)
+            self.assertAlmostEqual(1., sum(probs))
+            board, _ = game.getNextState(board, 1, int(np.argmax(probs)))
+        # every board of the ring is in the tree, and repeats are scored as draws
+        self.assertEqual(4, len(mcts.nodes))
+        self.assertTrue(all(np.all(np.abs(node.Q) < 1e-3) for node in mcts.nodes.values()))
+
+    def test_root_parallel_search(self):
+        game, mcts = self.make_mcts(numMCTSSims=100, rootParallelWorkers=2)
+        board = self.board_from_moves(game, [0, 4, 1, 8])
+        # the generator search of self-play runs in this process
+        with self.assertLogs('MCTS', 'WARNING'):
+            runSteps(mcts.getActionProbSteps(board, temp=0), mcts.nnet)
+        self.assertIsNone(mcts.rootWorkers)
+        try:
+            probs = mcts.getActionProb(board, temp=0)
+            self.assertEqual(2, int(np.argmax(probs)))
+            self.assertEqual(100, mcts.searchStats['simulations'])
+            # every worker spends its first simulation expanding the root
+            counts, sims = mcts.rootWorkers.counts(board, 100)
+            self.assertEqual(100, sims)
+            self.assertEqual(98, counts.sum())
+            processes = mcts.rootWorkers.processes
+        finally:
+            mcts.closeRootWorkers()
+        self.assertFalse(any(process.is_alive() for process in processes))
+
+    def test_advance_root_keeps_chosen_subtree(self):
+        game, mcts = self.make_mcts()
+        board = game.getInitBoard()
+        mcts.getActionProb(board, temp=1)
+        root = mcts.nodes[game.stringRepresentation(board)]
+        i = int(np.argmax(root.N))
+        child = game.getCanonicalForm(*game.getNextState(board, 1, root.actions[i]))
+        child_node = mcts.nodes[game.stringRepresentation(child)]
+
+        inherited = mcts.advanceRoot(child)
+        self.assertEqual(child_node.Ns, inherited)
+        self.assertNotIn(game.stringRepresentation(board), mcts.nodes)
+        self.assertIs(child_node, mcts.nodes[game.stringRepresentation(child)])
+
+        sibling = int(root.actions[i - 1])
+        self.assertEqual(0, mcts.advanceRoot(self.board_from_moves(game, [sibling])))
+        self.assertEqual({}, mcts.nodes)
+
+    def test_node_budget(self):
+        for eviction in ['lru', 'visits']:
+            game, mcts = self.make_mcts(numMCTSSims=200, mctsMaxNodes=40, mctsEviction=eviction)
+            board = game.getInitBoard()
+            probs = mcts.getActionProb(board, temp=1)
+            self.assertAlmostEqual(1., sum(probs))
+            self.assertLessEqual(len(mcts.nodes), 40)
+            self.assertIn(game.stringRepresentation(board), mcts.nodes)
+            stats = mcts.tableStats()
+            self.assertGreater(stats['evictions'], 0)
+            self.assertGreater(stats['hits'], 0)
+            self.assertEqual(sum(sys.getsizeof(s) + node.nbytes() for s, node in mcts.nodes.items()), stats['bytes'])
+
+    def test_time_budget(self):
+        game, mcts = self.make_mcts(timeBudget=0.05, minMCTSSims=5, maxMCTSSims=100000)
+        probs, sims = mcts.getActionProbTimed(game.getInitBoard(), temp=1)
+        self.assertGreaterEqual(sims, 5)
+        self.assertAlmostEqual(1., sum(probs))
+
+        game, mcts = self.make_mcts(maxMCTSSims=30)
+        probs, sims = mcts.getActionProbTimed(game.getInitBoard(), temp=1, timeBudget=60)
+        self.assertEqual(30, sims)
+
+    def test_early_stop(self):
+        game, mcts = self.make_mcts(numMCTSSims=200, earlyStop=True)
+        board = self.board_from_moves(game, [0, 4, 1, 8])
+        probs, sims = mcts.getActionProbTimed(board, temp=0)
+        self.assertEqual(2, int(np.argmax(probs)))
+        self.assertLess(sims, 200)
+        self.assertEqual(200 - sims, mcts.searchStats['simulationsSaved'])
+
+        # only searches for the most visited action stop early
+        probs, sims = mcts.getActionProbTimed(board, temp=1)
+        self.assertEqual(200, sims)
+
+    def test_solver(self):
+        game, mcts = self.make_mcts(numMCTSSims=200, mctsSolver=True)
+        board = self.board_from_moves(game, [0, 4, 1, 8])
+        probs, sims = mcts.getActionProbTimed(board, temp=1)
+        root = mcts.nodes[game.stringRepresentation(board)]
+        self.assertEqual(1, root.proven)
+        self.assertLess(sims, 200)
+        self.assertEqual(1, probs[2])
+
+        # the opponent to move after (0,2) was played is proven lost
+        game, mcts = self.make_mcts(numMCTSSims=400, mctsSolver=True)
+        board = self.board_from_moves(game, [0, 4, 1])
+        mcts.getActionProb(board, temp=1)
+        root = mcts.nodes[game.stringRepresentation(board)]
+        self.assertEqual(0, root.proven)
+        self.assertTrue(all(p == 1 for p in root.provenEdges[root.actions != 2]))
+
+    def test_gumbel_root(self):
+        game, mcts = self.make_mcts(numMCTSSims=8, gumbelRoot=True)
+        board = self.board_from_moves(game, [0, 4, 1, 8])
+        probs, sims = mcts.getActionProbTimed(board, temp=0)
+        self.assertEqual(2, int(np.argmax(probs)))
+        self.assertEqual(8, sims)
+
+        probs = mcts.getActionProb(game.getInitBoard(), temp=1)
+        valids = game.getValidMoves(game.getInitBoard(), 1)
+        self.assertAlmostEqual(1., sum(probs))
+        self.assertTrue(all(p > 0 for p, v in zip(probs, valids) if v))
+
+        # descents reaching a leaf already pending are not counted
+        for seed in range(5):
+            np.random.seed(seed)
+            game, mcts = self.make_mcts(numMCTSSims=200, gumbelRoot=True)
+            mcts.getActionProb(game.getInitBoard(), temp=1)
+            self.assertEqual(199, mcts.nodes[game.stringRepresentation(game.getInitBoard())].N.sum())
+
+    def test_eval_cache(self):
+        game, mcts = self.make_mcts(evalCacheSize=1000)
+        cache = sharedEvalCache(1000)
+        cache.resetStats()
+        board = game.getInitBoard()
+        mcts.getActionProb(board, temp=1)
+        self.assertEqual(0, cache.stats()['hits'])
+
+        # a new search tree for the same network reuses the evaluations
+        mcts = MCTS(game, mcts.nnet, mcts.args)
+        mcts.getActionProb(board, temp=1)
+        self.assertGreater(cache.stats()['hits'], 0)
+
+        # loading weights gives the network a new version
+        version = mcts.nnet.modelVersion()
+        mcts.nnet.load_checkpoint('folder', 'filename')
+        self.assertNotEqual(version, mcts.nnet.modelVersion())
+        self.assertIsNone(cache.get(mcts.nnet.modelVersion(), game.stringRepresentation(board)))
+
+    def test_symmetry_keys(self):
+        game, mcts = self.make_mcts(numMCTSSims=100, symmetryKeys=True)
+        board = self.board_from_moves(game, [0, 4, 1, 8])
+        self.assertEqual(2, int(np.argmax(mcts.getActionProb(board, temp=0))))
+
+        # the four corner openings share one node
+        for corner in [0, 2, 6, 8]:
+            probs = mcts.getActionProb(self.board_from_moves(game, [corner]), temp=1)
+            self.assertEqual(0, probs[corner])
+            self.assertAlmostEqual(1., sum(probs))
+        corners = {game.stringRepresentation(game.getCanonicalSymmetry(self.board_from_moves(game, [corner]))[0])
+                   for corner in [0, 2, 6, 8]}
+        self.assertEqual(1, len(corners))
+        root = mcts.nodes[corners.pop()]
+        self.assertEqual(99 + 3 * 100, root.Ns)
+
+    def test_zobrist_keys(self):
+        game = AnimalShogiGame(100)
+        mcts = MCTS(game, UniformNNet(game), dotdict({'numMCTSSims': 50, 'cpuct': 1.0}))
+        board, player = game.getInitBoard(), 1
+        for _ in range(20):
+            canonicalBoard = game.getCanonicalForm(board, player)
+            if game.getGameEnded(canonicalBoard, 1) != 0:
+                break
+            pieces, moti, draw_counter = canonicalBoard
+            # the incrementally maintained hash matches the one computed from scratch
+            self.assertEqual(game.hashState((pieces, moti, {0: draw_counter[0]})), game.hashState(canonicalBoard))
+            probs = mcts.getActionProb(canonicalBoard, temp=1)
+            self.assertIsInstance(game.hashState(canonicalBoard), int)
+            self.assertIn(game.hashState(canonicalBoard), mcts.nodes)
+            board, player = game.getNextState(board, player, np.random.choice(len(probs), p=probs))
+
+    def test_sparse_valid_actions(self):
+        game = SparseTicTacToeGame()
+        mcts = MCTS(game, UniformNNet(game), dotdict({'numMCTSSims': 50, 'cpuct': 1.0}))
+        board = self.board_from_moves(TicTacToeGame(), [4])
+        probs = mcts.getActionProb(board, temp=1)
+        self.assertEqual(0, probs[4])
+        root = mcts.nodes[game.hashState(board)]
+        self.assertEqual([0, 1, 2, 3, 5, 6, 7, 8], list(root.actions))
+
+    def test_in_place_descent(self):
+        game = AnimalShogiGame(100)
+        board = game.getCanonicalForm(*game.getNextState(game.getInitBoard(), 1, 49))
+        pieces, moti, draw_counter = board[0].copy(), board[1].copy(), dict(board[2])
+        probs = {}
+        for inPlace in [True, False]:
+            mcts = MCTS(game, UniformNNet(game), dotdict({'numMCTSSims': 200, 'cpuct': 1.0, 'inPlaceDescent': inPlace}))
+            self.assertEqual(inPlace, mcts.inPlace)
+            probs[inPlace] = mcts.getActionProb(board, temp=1)
+            # the root board is left as it was
+            self.assertTrue(np.array_equal(pieces, board[0]))
+            self.assertTrue(np.array_equal(moti, board[1]))
+            self.assertEqual(draw_counter, board[2])
+        self.assertEqual(probs[True], probs[False])
+
+        # leaves waiting in a batch are copies, unaffected by later descents
+        game = OthelloGame(6)
+        board = game.getInitBoard()
+        for inPlace in [True, False]:
+            mcts = MCTS(game, UniformNNet(game), dotdict({'numMCTSSims': 200, 'cpuct': 1.0, 'mctsBatchSize': 8,
+                                                           'inPlaceDescent': inPlace}))
+            probs[inPlace] = mcts.getActionProb(board, temp=1)
+        self.assertTrue(np.array_equal(game.getInitBoard(), board))
+        self.assertEqual(probs[True], probs[False])
+
+    def test_collect_stats(self):
+        statsFile = os.path.join(tempfile.mkdtemp(), 'stats.jsonl')
+        game, mcts = self.make_mcts(collectStats=True, statsFile=statsFile)
+        mcts.getActionProb(game.getInitBoard(), temp=1)
+        mcts.getActionProb(self.board_from_moves(game, [4]), temp=1)
+        stats = mcts.searchStats
+        self.assertEqual(50, stats['simulations'])
+        self.assertGreater(stats['expanded'], 0)
+        self.assertGreaterEqual(stats['maxDepth'], stats['meanDepth'])
+        self.assertGreater(stats['gameTime'], 0)
+        self.assertAlmostEqual(stats['time'], stats['evaluateTime'] + stats['gameTime'] + stats['selectionTime'])
+
+        with open(statsFile) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([stats['simulations'] for stats in mcts.statsHistory], [stats['simulations'] for stats in lines])
+        total = aggregateStats(mcts.popStats())
+        self.assertEqual(2, total['searches'])
+        self.assertEqual(100, total['simulations'])
+        self.assertEqual(0, total['simulationsSaved'])
+        self.assertEqual([], mcts.statsHistory)
+
+        # the simulations saved by early stopping add up too
+        game, mcts = self.make_mcts(collectStats=True, earlyStop=True)
+        board = self.board_from_moves(game, [0, 4, 1, 8])
+        mcts.getActionProb(board, temp=0)
+        mcts.getActionProb(board, temp=0)
+        saved = [stats['simulationsSaved'] for stats in mcts.statsHistory]
+        self.assertGreater(sum(saved), 0)
+        self.assertEqual(sum(saved), aggregateStats(mcts.popStats())['simulationsSaved'])
+
+
+if __name__ == '__main__':
+    unittest.main()
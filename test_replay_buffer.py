@@ -0,0 +1,72 @@
+"""
+Unit tests for ReplayBuffer.py, storing Animal Shogi examples.
+
+To run tests:
+python -m unittest test_replay_buffer
+"""
+
+import os
+import tempfile
+import unittest
+from pickle import Pickler
+
+import numpy as np
+
+from Coach import Coach
+from ReplayBuffer import ReplayBuffer
+from animalshogi.AnimalShogiGame import AnimalShogiGame
+from test_helpers import UniformNNet
+from utils import *
+
+
+class TestReplayBuffer(unittest.TestCase):
+
+    def test_replay_buffer(self):
+        game = AnimalShogiGame(100)
+        board = game.getInitBoard()
+        examples = []
+        for k in range(7):
+            pi = np.zeros(game.getActionSize())
+            pi[k] = 1
+            examples.append(((board[0] * (k + 1), board[1] + k, board[2]), pi, (-1) ** k))
+        folder = os.path.join(tempfile.mkdtemp(), 'replay')
+        replay = ReplayBuffer(folder, 5)
+        replay.extend(examples[:3])
+        replay.extend(examples[3:])
+        # the ring keeps the 5 newest examples
+        self.assertEqual(5, len(replay))
+        for k in range(5):
+            (pieces, moti, draw_counter), pi, v = replay[k]
+            self.assertTrue(np.array_equal(examples[k + 2][0][0], pieces))
+            self.assertTrue(np.array_equal(examples[k + 2][0][1], moti))
+            self.assertEqual({}, draw_counter)
+            self.assertEqual(k + 2, int(np.argmax(pi)))
+            self.assertEqual((-1) ** k, v)
+
+        # reopening gives the same examples, and sampling whole batches
+        replay = ReplayBuffer(folder, 5)
+        self.assertEqual(5, len(replay))
+        self.assertTrue(np.array_equal(replay[4][1], examples[6][1]))
+        (pieces, moti, _), pis, vs = replay.sample(16)
+        self.assertEqual((16,) + board[0].shape, pieces.shape)
+        self.assertEqual((16, game.getActionSize()), pis.shape)
+        self.assertTrue(all(v in (-1, 1) for v in vs))
+        (pieces, moti, _), pis, vs = replay.arrays()
+        self.assertTrue(np.array_equal(np.array([e[0][0] for e in examples[2:]]), pieces))
+        self.assertEqual([2, 3, 4, 5, 6], np.argmax(pis, axis=1).tolist())
+
+        # a run resumed with an empty replay buffer imports the pickled history
+        checkpoint = tempfile.mkdtemp()
+        with open(os.path.join(checkpoint, 'best.pth.tar.examples'), 'wb') as f:
+            Pickler(f).dump([examples[:3], examples[3:]])
+        args = dotdict({'checkpoint': checkpoint, 'load_folder_file': (checkpoint, 'best.pth.tar'),
+                        'replayBuffer': True, 'replayBufferSize': 100})
+        c = Coach(game, UniformNNet(game), args)
+        c.loadTrainExamples()
+        self.assertEqual(7, len(c.replayBuffer))
+        self.assertEqual([], c.trainExamplesHistory)
+        self.assertTrue(c.skipFirstSelfPlay)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,7 @@
 from __future__ import print_function
 import sys
 sys.path.append('..')
-from Game import Game
+from Game import Game, squareBoardSymmetry
 from .TicTacToeLogic import Board
 import numpy as np
 
@@ -90,6 +90,9 @@ class TicTacToeGame(Game):
                 l += [(newB, list(newPi.ravel()) + [pi[-1]])]
         return l
 
+    def getCanonicalSymmetry(self, board):
+        return squareBoardSymmetry(board, self.n)
+
     def stringRepresentation(self, board):
         # 8x8 numpy array (canonical board)
         return board.tostring()
@@ -1,3 +1,8 @@
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+
 class AverageMeter(object):
     """From https://github.com/pytorch/examples/blob/master/imagenet/main.py"""
 
@@ -19,4 +24,37 @@ class AverageMeter(object):
 
 class dotdict(dict):
     def __getattr__(self, name):
-        return self[name]
+        try:
+            return self[name]
+        except KeyError:
+            # lets getattr(args, name, default) read optional settings
+            raise AttributeError(name)
+
+
+def spawnContext():
+    """
+    Returns the multiprocessing context of all the worker processes: spawn
+    rather than fork, so that they do not inherit the CUDA state of the parent.
+    """
+    return multiprocessing.get_context('spawn')
+
+
+def workerPool(workers, initializer=None, initargs=()):
+    """
+    Returns a ProcessPoolExecutor of workers processes of spawnContext, which
+    run initializer(*initargs) once started, with torch limited to one thread
+    since the workers already keep every core busy.
+    """
+    return ProcessPoolExecutor(workers, mp_context=spawnContext(), initializer=initWorker,
+                               initargs=(initializer, initargs))
+
+
+def initWorker(initializer, initargs):
+    """
+    Initializes a worker process of workerPool.
+    """
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        torch.set_num_threads(1)
+    if initializer is not None:
+        initializer(*initargs)